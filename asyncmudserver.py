@@ -0,0 +1,360 @@
+"""asyncio-based MUD server module.
+
+Contains AsyncMudServer, which offers the same interface as MudServer
+but runs each connection as an asyncio task, and BlockingMudServer, a
+thin adapter which lets existing tick-based game code such as
+starliner.py drive an AsyncMudServer without being rewritten.
+
+Game code written for asyncio can await commands directly:
+
+    mud = AsyncMudServer()
+    await mud.start()
+    while True:
+        await mud.update()
+        for id, command, params in mud.get_commands():
+            ...
+
+and push slow work such as database queries or password hashing off
+the event loop with 'await mud.run_blocking(func, *args)'.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import threading
+import time
+
+from mudserver import MudServer, Timer
+
+
+class AsyncMudServer(MudServer):
+    """A MUD server built on asyncio streams.
+
+    Each connected player is served by its own reader task, so nothing
+    needs to poll sockets. The 'update' method is a coroutine which
+    waits until something has happened and then makes the new players,
+    disconnected players and commands available in the same way as
+    MudServer.update.
+    """
+
+    class _StreamSocket(object):
+        """Gives an asyncio stream writer the small part of the socket
+        interface that MudServer's sending code relies on"""
+
+        def __init__(self, writer):
+            self.writer = writer
+
+        def sendall(self, data):
+            if not self.writer.is_closing():
+                self.writer.write(bytes(data))
+
+        def buffered(self):
+            # how much data the transport is still holding for the client
+            return self.writer.transport.get_write_buffer_size()
+
+        def setsockopt(self, *args):
+            self.writer.get_extra_info("socket").setsockopt(*args)
+
+        def close(self):
+            self.writer.close()
+
+    # the asyncio server object accepting new connections
+    _server = None
+    # set whenever a new event is added, so that 'update' can wake up
+    _wakeup = None
+    # the event loop the server is running on
+    _loop = None
+
+    def __init__(self, host="0.0.0.0", port=1234, backlog=128,
+                 high_water=64 * 1024, lag_timeout=30.0,
+                 coalesce_output=False, tcp_keepalive=False):
+        """Constructs the AsyncMudServer object. Call 'start' from within
+        a running event loop to begin listening for new players. The
+        parameters work as they do for MudServer.
+        """
+
+        self._high_water = high_water
+        self._lag_timeout = lag_timeout
+        self._coalesce_output = coalesce_output
+        self._tcp_keepalive = tcp_keepalive
+        self._pending_flush = set()
+        self._host = host
+        self._port = port
+        self._backlog = backlog
+        self._clients = {}
+        self._nextid = 0
+        self._events = []
+        self._new_events = []
+        self._timers = []
+        self._timer_seq = 0
+        self._callbacks = collections.deque()
+        self._server = None
+        self._wakeup = asyncio.Event()
+
+    async def start(self):
+        """Starts listening for new players."""
+
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_connection,
+                                                  self._host, self._port,
+                                                  backlog=self._backlog)
+
+    async def update(self, timeout=None):
+        """Waits until a player has connected, disconnected or sent a
+        command, then makes those events available through
+        'get_new_players', 'get_disconnected_players' and 'get_commands'.
+
+        'timeout' is how many seconds to wait for something to happen.
+        The default of None waits as long as it takes. Callbacks passed to
+        'call_soon_threadsafe' are run from here, as MudServer does.
+        """
+
+        # write out the output from the last pass of the game loop before
+        # waiting for anything new
+        self.flush()
+
+        if not self._new_events and not self._callbacks:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wakeup.clear()
+
+        self._run_callbacks()
+        self.flush()
+
+        # move the new events into the main events list, discarding the
+        # previous ones
+        self._events = list(self._new_events)
+        self._new_events = []
+
+    def call_later(self, delay, callback, *args):
+        """Arranges for 'callback' to be called with 'args' once 'delay'
+        seconds have passed. Returns a Timer which can be used to cancel
+        it.
+        """
+        timer = Timer(callback, args)
+        asyncio.get_running_loop().call_later(delay, self._run_timer, timer)
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Arranges for 'callback' to be called with 'args' from within
+        'update' as soon as possible, waking it up if it is waiting. Can
+        be called from any thread.
+        """
+        self._callbacks.append((callback, args))
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def call_every(self, interval, callback, *args):
+        """Arranges for 'callback' to be called with 'args' every
+        'interval' seconds. Returns a Timer which can be used to cancel
+        it.
+        """
+        timer = Timer(callback, args, interval)
+        asyncio.get_running_loop().call_later(interval, self._run_timer,
+                                              timer)
+        return timer
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Runs a blocking function, such as a database query or a
+        password hash, in a worker thread and returns its result without
+        holding up any other player.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        """Closes down the server, disconnecting all clients and
+        closing the listen socket.
+        """
+        for cl in self._clients.values():
+            cl.socket.close()
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle_connection(self, reader, writer):
+
+        # register the new client, exactly as MudServer does when it
+        # accepts a connection
+        id = self._nextid
+        self._nextid += 1
+        addr = writer.get_extra_info("peername")
+        cl = MudServer._Client(AsyncMudServer._StreamSocket(writer), addr[0],
+                               b"", time.time())
+        self._clients[id] = cl
+        self._start_liveness_check(id)
+
+        writer.write(bytes([self._TN_INTERPRET_AS_COMMAND, self._TN_WILL,
+                            self._GMCP]))
+        writer.write(bytes([self._TN_INTERPRET_AS_COMMAND, self._TN_WILL,
+                            self._MXP]))
+
+        self._add_event((self._EVENT_NEW_PLAYER, id))
+
+        try:
+            while id in self._clients:
+                # wait for data from the client. An empty result means the
+                # client has closed the connection
+                data = await reader.read(4096)
+                if not data:
+                    break
+
+                messages = self._process_sent_data(cl, data)
+                if cl.outbuf:
+                    self._flush(id)
+                for message in messages:
+                    self._add_command(id, message)
+                if messages:
+                    self._wakeup.set()
+
+        # a connection problem (e.g. the connection being reset) ends the
+        # reader task in the same way as a clean disconnect
+        except OSError:
+            pass
+
+        if id in self._clients:
+            self._handle_disconnect(id)
+        writer.close()
+
+    def _flush(self, clid):
+        cl = self._clients[clid]
+
+        # the transport does its own buffering, so hand everything over and
+        # watch how much it is still holding
+        if cl.outbuf:
+            cl.socket.sendall(cl.outbuf)
+            del cl.outbuf[:]
+        self._check_backlog(clid)
+
+    def _pending_output(self, cl):
+        return len(cl.outbuf) + cl.socket.buffered()
+
+    def _run_timer(self, timer):
+        if timer.cancelled:
+            return
+        if timer.interval is not None:
+            asyncio.get_running_loop().call_later(timer.interval,
+                                                  self._run_timer, timer)
+        timer.callback(*timer.args)
+
+    def _add_event(self, event):
+        self._new_events.append(event)
+        self._wakeup.set()
+
+    def _handle_disconnect(self, clid):
+
+        # stop checking whether the client is still connected
+        if self._clients[clid].liveness is not None:
+            self._clients[clid].liveness.cancel()
+
+        # remove the client from the clients map
+        del (self._clients[clid])
+
+        # add a 'player left' occurence to the new events list
+        self._add_event((self._EVENT_PLAYER_LEFT, clid))
+
+
+class BlockingMudServer(object):
+    """Runs an AsyncMudServer on an event loop in a background thread and
+    exposes it with MudServer's ordinary blocking interface.
+
+    Every method call is passed to the event loop thread and waits for
+    its result, so existing game loops only need to swap 'MudServer()'
+    for 'BlockingMudServer()'. Callbacks, including timers, run within
+    'update' on the thread calling it, as they do with MudServer.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+        self._callbacks = collections.deque()
+        self._server = self._call(AsyncMudServer, *args, **kwargs)
+        self._await(self._server.start())
+
+    def update(self, timeout=None):
+        """Blocks until something has happened, as MudServer.update
+        does with a timeout of None.
+        """
+        self._await(self._server.update(timeout))
+
+        # callbacks run here rather than on the event loop thread, so that
+        # they can safely change the game's state
+        for i in range(len(self._callbacks)):
+            callback, args = self._callbacks.popleft()
+            callback(*args)
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Arranges for 'callback' to be called with 'args' from within
+        'update', on the thread calling it, as soon as possible. Can be
+        called from any thread.
+        """
+        self._callbacks.append((callback, args))
+        # wake up 'update' so that the callback isn't left waiting
+        self._server.call_soon_threadsafe(lambda: None)
+
+    def call_later(self, delay, callback, *args):
+        """Arranges for 'callback' to be called with 'args' from within
+        'update', on the thread calling it, once 'delay' seconds have
+        passed. Returns a Timer which can be used to cancel it.
+        """
+        timer = Timer(callback, args)
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay, self._timer_due, timer)
+        return timer
+
+    def call_every(self, interval, callback, *args):
+        """Arranges for 'callback' to be called with 'args' from within
+        'update', on the thread calling it, every 'interval' seconds.
+        Returns a Timer which can be used to cancel it.
+        """
+        timer = Timer(callback, args, interval)
+        self._loop.call_soon_threadsafe(self._loop.call_later, interval, self._timer_due, timer)
+        return timer
+
+    def shutdown(self):
+        """Closes down the server and stops the event loop thread."""
+        self._call(self._server.shutdown)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __getattr__(self, name):
+        attr = getattr(self._server, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._call(attr, *args, **kwargs)
+
+        return call
+
+    def _timer_due(self, timer):
+        # runs on the event loop thread, so the callback itself is handed to
+        # 'update' like any other
+        if timer.cancelled:
+            return
+        if timer.interval is not None:
+            self._loop.call_later(timer.interval, self._timer_due, timer)
+        self.call_soon_threadsafe(self._run_timer, timer)
+
+    def _run_timer(self, timer):
+        # the timer may have been cancelled while waiting for 'update'
+        if not timer.cancelled:
+            timer.callback(*timer.args)
+
+    def _await(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _call(self, func, *args, **kwargs):
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+        self._loop.call_soon_threadsafe(run)
+        return future.result()
@@ -0,0 +1,92 @@
+"""Password hashing for starliner.py.
+
+Contains Authenticator, which runs bcrypt hashing and checking in a
+pool of worker processes so that a player logging in doesn't stop the
+game for everyone else while their password is checked.
+"""
+
+import concurrent.futures
+import multiprocessing
+
+import bcrypt
+
+
+def _hash_password(password, rounds):
+    # stored as text, so that every database hands back the same type
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('ascii')
+
+
+def _check_password(password, hashed):
+    # hashes stored before they were kept as text come back as bytes
+    if isinstance(hashed, str):
+        hashed = hashed.encode('utf-8')
+    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+
+
+def _warm_up():
+    pass
+
+
+class Authenticator(object):
+    """Hashes and checks passwords in the background.
+
+    Work is done by 'workers' processes. Results are passed back using
+    'deliver', a function which takes a callback and its arguments and
+    arranges for it to be called on the game's own thread, such as
+    MudServer.call_soon_threadsafe. 'rounds' is the bcrypt cost factor
+    used for new password hashes.
+
+    Worker processes are forked, which is only possible on platforms with
+    fork(). Elsewhere threads are used instead; bcrypt releases the GIL
+    while it works, so these still run alongside the game.
+    """
+
+    def __init__(self, deliver, workers=2, rounds=12):
+        self._deliver = deliver
+        self._rounds = rounds
+
+        if 'fork' in multiprocessing.get_all_start_methods():
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+            # start the worker processes now, while this is the only thread
+            # in the server, rather than forking later on
+            self._pool.submit(_warm_up).result()
+        else:
+            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def hash_password(self, password, callback, *args):
+        """Hashes 'password' for storing, then calls 'callback' with the
+        hash followed by 'args'. The hash is None if hashing failed.
+        """
+        self._submit("hashing", callback, args, _hash_password, password, self._rounds)
+
+    def check_password(self, password, hashed, callback, *args):
+        """Checks 'password' against a stored hash, then calls 'callback'
+        with True if it matched or False if not, followed by 'args'. If
+        the check couldn't be done, None is passed instead.
+        """
+        self._submit("checking", callback, args, _check_password, password, hashed)
+
+    def close(self):
+        """Stops the worker processes. Call this when shutting down."""
+        self._pool.shutdown(wait=False)
+
+    def _submit(self, what, callback, args, func, *funcargs):
+        try:
+            future = self._pool.submit(func, *funcargs)
+        except concurrent.futures.BrokenExecutor as e:
+            # a worker process has died, and the pool won't take any more
+            # work. The callback is still called, with the failure
+            future = concurrent.futures.Future()
+            future.set_exception(e)
+        future.add_done_callback(
+            lambda f: self._deliver(self._finish, f, what, callback, args))
+
+    def _finish(self, future, what, callback, args):
+        # runs on the game's thread
+        try:
+            result = future.result()
+        except Exception as e:
+            print("Password {} failed: {}".format(what, e))
+            result = None
+        callback(result, *args)
@@ -0,0 +1,57 @@
+"""Benchmark for color code rendering.
+
+Compares render_colors, both with a warm cache and with caching
+bypassed, against the old multiple_replace approach on the kind of
+strings starliner.py sends, and checks that all of them give the same
+output.
+
+usage: python benchmarks/color_markup.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mudserver import get_color_list, multiple_replace, render_colors
+
+
+MESSAGES = [
+    "\n\rMark [%bold%yellow120 gold%reset] [%bold%red100 HP%reset] :> ",
+    "\n\r%bold%cyanThe Bridge\r\n",
+    "%cyanPlayers: %resetMark, Alice, Bob",
+    "%cyanExits: %resetnorth, south, airlock",
+    "%bold%blueMark says: hello there",
+    "  look                   - Examines the surroundings, e.g. 'look'",
+    "%greenYour Weapon: %resetrusty pipe",
+    "%boldoff%underline%underlineoff%blink%blinkoff%reverse%reverseoff%resetall",
+    "%re%boldd",
+]
+
+
+def legacy(text, color_enabled):
+    return multiple_replace(text, get_color_list(), color_enabled)
+
+
+def run(func):
+    for text in MESSAGES:
+        func(text, True)
+        func(text, False)
+
+
+def main():
+    for text in MESSAGES:
+        for enabled in (True, False):
+            assert render_colors(text, enabled) == legacy(text, enabled), text
+
+    per = len(MESSAGES) * 2
+    for name, func in (("legacy", legacy),
+                       ("uncached", render_colors.__wrapped__),
+                       ("cached", render_colors)):
+        best = min(timeit.repeat(lambda: run(func), number=2000, repeat=5))
+        print("{:9} {:8.3f} us/message".format(name, best / 2000 / per * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Connection storm benchmark for MudServer.
+
+Opens a burst of connections at once, as happens when players all
+reconnect after a network blip, and times how long the server takes to
+accept every one of them. It is run once with an accept budget of 1,
+which is how the server used to behave, and once with the default
+budget.
+
+usage: python benchmarks/connection_storm.py [connections]
+"""
+
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mudserver import MudServer
+
+
+def storm(connections, accept_budget):
+    mud = MudServer(host="127.0.0.1", port=0, backlog=connections,
+                    accept_budget=accept_budget)
+    address = mud._listen_socket.getsockname()
+
+    clients = []
+    start = time.perf_counter()
+    for i in range(connections):
+        clients.append(socket.create_connection(address))
+
+    accepted = 0
+    updates = 0
+    while accepted < connections:
+        mud.update(1.0)
+        updates += 1
+        accepted += len(mud.get_new_players())
+    elapsed = time.perf_counter() - start
+
+    mud.shutdown()
+    for cl in clients:
+        cl.close()
+    return elapsed, updates
+
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print("{} connections".format(connections))
+    for budget in (1, 64):
+        elapsed, updates = storm(connections, budget)
+        print("accept budget {:3}: {:4} updates, {:7.1f} ms "
+              "({:.1f} s with a 200 ms game loop tick)".format(
+                  budget, updates, elapsed * 1000, updates * 0.2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Benchmark for the game logic on its own.
+
+Pushes synthetic commands from many players through the real Engine
+using an in-memory FakeTransport, with no sockets or database. Storage,
+write-behind and password checking are replaced by simple in-memory
+stand-ins, so the time measured is the game's own. Reports commands
+per second and a per-command breakdown from a CommandTimer.
+
+usage: python benchmarks/engine_commands.py [players] [commands] [rooms]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from commands import CommandTimer
+from engine import Engine
+from models import NPC, Exit, ItemDef, Room, WorldObject
+from transports import FakeTransport
+
+SWORD = ItemDef(1, 'sword', 'A sword.', False, False, False, True, 10, 100, False)
+
+
+class FakeItems(object):
+
+    def get(self, itemid):
+        return SWORD
+
+
+class FakeUnitOfWork(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def add_inventory(self, pid, itemid):
+        pass
+
+    def remove_inventory(self, pid, itemid):
+        pass
+
+    def set_attrib(self, pid, attrib, value):
+        pass
+
+
+class FakeStorage(object):
+
+    def __init__(self):
+        self.items = FakeItems()
+
+    def name_taken(self, name):
+        return False
+
+    def create_player(self, name, hashed):
+        return 1
+
+    def unit_of_work(self):
+        return FakeUnitOfWork()
+
+    def load_player(self, name):
+        return {'id': 1, 'name': name, 'password': 'password', 'lastroom': 1, 'attribs': {}, 'inventory': [SWORD],
+                'items': {}}
+
+
+class FakeWrites(object):
+
+    def set_room(self, pid, room):
+        pass
+
+    def set_attrib(self, pid, attrib, value):
+        pass
+
+    def pending(self, key, default=None):
+        return default
+
+    def flush(self, wait=False):
+        pass
+
+
+class FakeAuth(object):
+    """Accepts any password straight away"""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def check_password(self, password, hashed, callback, *args):
+        self.transport.call_soon_threadsafe(callback, True, *args)
+
+    def hash_password(self, password, callback, *args):
+        self.transport.call_soon_threadsafe(callback, "hashed", *args)
+
+
+def build_world(rooms):
+    # a ring of rooms, each with an object and every tenth with a scrapbot
+    world = {}
+    for i in range(1, rooms + 1):
+        npcs = [NPC(1, 'scrapbot', 'A scrapbot.', 1, '')] if i % 10 == 0 else []
+        world[i] = Room(i, "Room {}".format(i), "A room.\n\rIt is room {}.".format(i),
+                        [Exit('north', i % rooms + 1, 0, ''), Exit('south', (i - 2) % rooms + 1, 0, '')],
+                        [WorldObject(i, 'rock', 'A rock.', 0, "It's too heavy.", '', 0)], npcs)
+    return world
+
+
+COMMANDS = ["look", "say hello", "go north", "go south", "inventory", "examine rock", "examine sword",
+            "take rock", "help", "l", "inv", "x rock", "nonsense"]
+
+
+def main():
+    nplayers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    ncommands = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    nrooms = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    transport = FakeTransport()
+    timer = CommandTimer()
+    engine = Engine(build_world(nrooms), FakeStorage(), FakeWrites(), FakeAuth(transport), ["Welcome!"], timer)
+
+    ids = [transport.connect() for _ in range(nplayers)]
+    for id in ids:
+        transport.type(id, "player{}".format(id))
+        transport.type(id, "password")
+    # one pass for the names and passwords, one for the password checks
+    engine.process(transport)
+    engine.process(transport)
+    assert len(engine.occupancy.players_in(1)) == nplayers, "players didn't all log in"
+
+    script = [(random.choice(ids), random.choice(COMMANDS)) for _ in range(ncommands)]
+    start = time.perf_counter()
+    for id, line in script:
+        transport.type(id, line)
+        engine.process(transport)
+        # keep the output from building up
+        transport.output[id] = []
+    elapsed = time.perf_counter() - start
+
+    print("{} players, {} rooms: {} commands in {:.2f} s, {:.0f} commands/s".format(
+        nplayers, nrooms, ncommands, elapsed, ncommands / elapsed))
+    print("\n".join(timer.report()))
+
+
+if __name__ == "__main__":
+    main()
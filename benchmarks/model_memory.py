@@ -0,0 +1,126 @@
+"""Benchmark for the memory taken by players and rooms.
+
+Builds the same players and rooms twice, once as the dictionaries the
+game used to keep them in and once as the slotted classes from
+models.py, and uses tracemalloc to measure how much memory each takes.
+Every player carries a few items, which are shared definitions in both
+cases, as they come from the item cache. Reports bytes per player, per
+room and per item definition.
+
+usage: python benchmarks/model_memory.py [players] [rooms]
+"""
+
+import os
+import sys
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models import NPC, Exit, ItemDef, Player, Room, WorldObject
+
+# how many item definitions the players' inventories are drawn from
+ITEMS = 50
+
+
+def dict_items():
+    return [types.MappingProxyType({'id': i, 'name': "item{}".format(i), 'description': "Item {}.".format(i),
+                                    'invulnerable': False, 'isuniq': False, 'isarmor': i % 5 == 0,
+                                    'isweapon': i % 5 == 1, 'power': i, 'basevalue': i * 10, 'bound': False})
+            for i in range(ITEMS)]
+
+
+def model_items():
+    return [ItemDef(i, "item{}".format(i), "Item {}.".format(i), False, False, i % 5 == 0, i % 5 == 1, i, i * 10,
+                    False) for i in range(ITEMS)]
+
+
+def dict_players(n, items):
+    players = {}
+    for pid in range(n):
+        players[pid] = {"name": "player{}".format(pid), "room": pid % 100 + 1, "dbid": pid, "password": "password",
+                        "newplayer": False, "authenticating": False, "health": 100, "gold": pid, "color": True,
+                        "armor": items[0], "weapon": items[1], "target": None,
+                        "inventory": [items[(pid + i) % ITEMS] for i in range(5)]}
+    return players
+
+
+def model_players(n, items):
+    players = {}
+    for pid in range(n):
+        player = Player()
+        player.name = "player{}".format(pid)
+        player.room = pid % 100 + 1
+        player.dbid = pid
+        player.password = "password"
+        player.gold = pid
+        player.armor = items[0]
+        player.weapon = items[1]
+        player.inventory.extend(items[(pid + i) % ITEMS] for i in range(5))
+        players[pid] = player
+    return players
+
+
+def dict_rooms(n):
+    # laid out as world.load_world used to, including the name indexes
+    rooms = {}
+    for i in range(1, n + 1):
+        room = {'id': i, 'name': "Room {}".format(i), 'description': "A room.\n\rIt is room {}.".format(i),
+                'exits': [{'name': 'north', 'toroom': i % n + 1, 'itemkey': 0, 'failkey': ''},
+                          {'name': 'south', 'toroom': (i - 2) % n + 1, 'itemkey': 0, 'failkey': ''}],
+                'items': [{'id': i, 'name': 'rock', 'description': 'A rock.', 'movable': 0,
+                           'failtake': "It's too heavy.", 'takesuccess': '', 'takeitem': 0}],
+                'npcs': []}
+        if i % 5 == 0:
+            room['npcs'].append({'id': 1, 'name': 'scrapbot', 'description': 'A scrapbot.', 'code': 1, 'arg': ''})
+        for listname, indexname in (('exits', 'exitsbyname'), ('items', 'itemsbyname'), ('npcs', 'npcsbyname')):
+            room[indexname] = {}
+            for entry in room[listname]:
+                room[indexname].setdefault(entry['name'].lower(), entry)
+        rooms[i] = room
+    return rooms
+
+
+def model_rooms(n):
+    rooms = {}
+    for i in range(1, n + 1):
+        npcs = [NPC(1, 'scrapbot', 'A scrapbot.', 1, '')] if i % 5 == 0 else []
+        rooms[i] = Room(i, "Room {}".format(i), "A room.\n\rIt is room {}.".format(i),
+                        [Exit('north', i % n + 1, 0, ''), Exit('south', (i - 2) % n + 1, 0, '')],
+                        [WorldObject(i, 'rock', 'A rock.', 0, "It's too heavy.", '', 0)], npcs)
+    return rooms
+
+
+def measure(build, *args):
+    # returns the bytes still allocated once 'build' has returned, while
+    # what it built is kept alive
+    tracemalloc.start()
+    try:
+        built = build(*args)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del built
+    return size
+
+
+def report(what, count, before, after):
+    print("{:>10}: {:8.0f} bytes each as dicts, {:8.0f} as models ({:.0f}% less)".format(
+        what, before / count, after / count, (1 - after / before) * 100))
+
+
+def main():
+    nplayers = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    nrooms = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    olditems = dict_items()
+    newitems = model_items()
+
+    print("{} players, {} rooms, {} item definitions".format(nplayers, nrooms, ITEMS))
+    report("item", ITEMS, measure(dict_items), measure(model_items))
+    report("player", nplayers, measure(dict_players, nplayers, olditems), measure(model_players, nplayers, newitems))
+    report("room", nrooms, measure(dict_rooms, nrooms), measure(model_rooms, nrooms))
+
+
+if __name__ == "__main__":
+    main()
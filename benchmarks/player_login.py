@@ -0,0 +1,91 @@
+"""Benchmark for loading a player at login.
+
+Compares the old way of loading a player (one query for the player,
+one for their inventory, one per inventory item and one per attribute)
+with Storage.load_player, for players carrying different numbers of
+items. Needs a test database set up with the game's schema and at
+least one row in itemdef, configured in db.json as for the server. A
+temporary player is created and removed again.
+
+usage: python benchmarks/player_login.py [db.json]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from config import Config
+from storage import ITEM_COLUMNS, item_from_row, open_storage
+
+PLAYER = "benchloginplayer"
+
+
+def legacy_load(db, name):
+    with db.connection() as mydb:
+        mycursor = mydb.cursor()
+        mycursor.execute("SELECT id, name, password, lastroom FROM players WHERE name = %s", (name,))
+        row = mycursor.fetchone()
+    with db.connection() as mydb:
+        mycursor = mydb.cursor()
+        mycursor.execute("SELECT itemid FROM inventory WHERE playerid = %s", (row[0],))
+        itemids = [irow[0] for irow in mycursor.fetchall()]
+    inventory = []
+    for itemid in itemids:
+        with db.connection() as mydb:
+            mycursor = mydb.cursor()
+            mycursor.execute("SELECT " + ", ".join(ITEM_COLUMNS) + " FROM itemdef WHERE id = %s", (itemid,))
+            inventory.append(item_from_row(mycursor.fetchone()))
+    for attrib in ("health", "gold", "color", "armor", "weapon"):
+        with db.connection() as mydb:
+            mycursor = mydb.cursor()
+            mycursor.execute("SELECT value FROM playerattr WHERE pid = %s AND attrib = %s", (row[0], attrib))
+            mycursor.fetchone()
+    return inventory
+
+
+def set_inventory(db, pid, itemid, count):
+    with db.connection() as mydb:
+        mycursor = mydb.cursor()
+        mycursor.execute("DELETE FROM inventory WHERE playerid = %s", (pid,))
+        for i in range(count):
+            mycursor.execute("INSERT INTO inventory (itemid, playerid) VALUES(%s, %s)", (itemid, pid))
+
+
+def timed(func, *args):
+    best = None
+    for i in range(5):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    db = open_storage(Config(sys.argv[1] if len(sys.argv) > 1 else "db.json"))
+    with db.connection() as mydb:
+        mycursor = mydb.cursor()
+        mycursor.execute("SELECT id FROM itemdef LIMIT 1")
+        itemid = mycursor.fetchone()[0]
+        mycursor.execute("INSERT INTO players (name, password, lastroom) VALUES(%s, %s, 1)", (PLAYER, "x"))
+        pid = mycursor.lastrowid
+
+    try:
+        for count in (0, 10, 200):
+            set_inventory(db, pid, itemid, count)
+            legacy = timed(legacy_load, db, PLAYER)
+            bulk = timed(db.load_player, PLAYER)
+            print("{:4} items: legacy {:8.2f} ms, load_player {:6.2f} ms".format(
+                count, legacy * 1000, bulk * 1000))
+    finally:
+        with db.connection() as mydb:
+            mycursor = mydb.cursor()
+            mycursor.execute("DELETE FROM inventory WHERE playerid = %s", (pid,))
+            mycursor.execute("DELETE FROM players WHERE id = %s", (pid,))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark for sending a message to everyone in a room.
+
+Compares finding a speaker's roommates by looking at every player in the
+game, as 'say' and 'go' used to, with looking them up in an Occupancy
+index, for a game with players spread evenly over many rooms. Reports
+the time per 'say' and how many players each one looks at.
+
+usage: python benchmarks/room_broadcast.py [players] [rooms]
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from world import Occupancy
+
+
+class Counter(object):
+    """Stands in for MudServer.broadcast, counting the players that each
+    message is sent to"""
+
+    def __init__(self):
+        self.sent = 0
+
+    def broadcast(self, client_ids, message, exclude=None):
+        for to in client_ids:
+            if to != exclude:
+                self.sent += 1
+
+
+def main():
+    nplayers = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    nrooms = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    players = {}
+    occupancy = Occupancy()
+    for pid in range(nplayers):
+        players[pid] = {"name": "player{}".format(pid), "room": pid % nrooms + 1}
+        occupancy.add(pid, players[pid]["room"])
+
+    speakers = [random.randrange(nplayers) for _ in range(1000)]
+
+    def legacy(mud, id):
+        roomplayers = [pid for pid, pl in players.items()
+                       if pl["room"] == players[id]["room"]]
+        mud.broadcast(roomplayers, "{} says: hello".format(players[id]["name"]))
+        return len(players)
+
+    def indexed(mud, id):
+        roommates = occupancy.players_in(players[id]["room"])
+        mud.broadcast(roommates, "{} says: hello".format(players[id]["name"]))
+        return len(roommates)
+
+    print("{} players in {} rooms".format(nplayers, nrooms))
+    for name, say in (("legacy", legacy), ("occupancy", indexed)):
+        mud = Counter()
+        looked = sum(say(mud, id) for id in speakers)
+        sent = mud.sent
+        best = min(timeit.repeat(lambda: [say(mud, id) for id in speakers], number=10, repeat=5))
+        print("{:>10}: {:8.2f} us/say, {:6.1f} players looked at, {:4.1f} sent to".format(
+            name, best / 10 / len(speakers) * 1e6, looked / len(speakers), sent / len(speakers)))
+
+
+if __name__ == "__main__":
+    main()
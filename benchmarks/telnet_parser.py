@@ -0,0 +1,101 @@
+"""Benchmark for MudServer's Telnet input parser.
+
+Compares the bytes-level parser in mudserver.py with the old
+character-by-character parser on a large block of pasted input, fed
+to the parser in 4096-byte reads as it would arrive from the socket.
+
+usage: python benchmarks/telnet_parser.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mudserver import MudServer
+
+
+class _Client(object):
+    """Just enough of a client for either parser to work on"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.read_state = MudServer._READ_STATE_NORMAL
+        self.option_support = 0
+        self.outbuf = bytearray()
+        self.MXP_ENABLED = False
+        self.GMCP_ENABLED = False
+
+
+def legacy_process_sent_data(client, data):
+    """The parser as it was before it worked on bytes, minus the MXP and
+    GMCP replies which the benchmark input doesn't trigger. Only the last
+    line in each read is returned."""
+    message = None
+    state = MudServer._READ_STATE_NORMAL
+    for c in data:
+        if state == MudServer._READ_STATE_NORMAL:
+            if ord(c) == MudServer._TN_INTERPRET_AS_COMMAND:
+                state = MudServer._READ_STATE_COMMAND
+            elif c == "\n":
+                message = client.buffer
+                client.buffer = ""
+            elif c == "\x08":
+                client.buffer = client.buffer[:-1]
+            else:
+                client.buffer += c
+        elif state == MudServer._READ_STATE_COMMAND:
+            if ord(c) == MudServer._TN_SUBNEGOTIATION_START:
+                state = MudServer._READ_STATE_SUBNEG
+            elif ord(c) in (MudServer._TN_WILL, MudServer._TN_WONT,
+                            MudServer._TN_DO, MudServer._TN_DONT):
+                state = MudServer._READ_STATE_COMMAND
+            else:
+                state = MudServer._READ_STATE_NORMAL
+        elif state == MudServer._READ_STATE_SUBNEG:
+            if ord(c) == MudServer._TN_SUBNEGOTIATION_END:
+                state = MudServer._READ_STATE_NORMAL
+    return message
+
+
+def make_input():
+    lines = []
+    for i in range(5000):
+        lines.append(b"say this is scripted line number %d of the paste\r\n" % i)
+        if i % 100 == 0:
+            # the odd window size report from the client
+            lines.append(b"\xff\xfa\x1f\x00\x50\x00\x18\xff\xf0")
+    data = b"".join(lines)
+    return [data[i:i + 4096] for i in range(0, len(data), 4096)]
+
+
+def run_legacy(chunks):
+    client = _Client()
+    client.buffer = ""
+    for chunk in chunks:
+        legacy_process_sent_data(client, chunk.decode("latin1"))
+
+
+def run_current(chunks):
+    server = MudServer.__new__(MudServer)
+    client = _Client()
+    lines = 0
+    for chunk in chunks:
+        lines += len(server._process_sent_data(client, chunk))
+    return lines
+
+
+def main():
+    chunks = make_input()
+    size = sum(len(c) for c in chunks)
+    print("input: {} bytes in {} reads, {} lines".format(
+        size, len(chunks), run_current(chunks)))
+    for name, func in (("legacy", run_legacy), ("current", run_current)):
+        best = min(timeit.repeat(lambda: func(chunks), number=5, repeat=3)) / 5
+        print("{:8} {:8.2f} ms  {:8.1f} MB/s".format(
+            name, best * 1000, size / best / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Benchmark for loading the world at startup.
+
+Compares the old way of loading the world (one query per room for its
+exits, and one per room plus one per object or NPC for its contents)
+with world.load_world and with reading a world snapshot, on a synthetic
+world held in an in-memory SQLite database. Each query is delayed by a simulated network round trip to
+stand in for a MySQL server on another machine.
+
+usage: python benchmarks/world_load.py [rooms] [round trip ms]
+"""
+
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from world import load_snapshot, load_world, save_snapshot
+
+
+class Cursor(object):
+    """Makes an sqlite3 cursor accept the mysql.connector parameter style,
+    and counts and delays every query"""
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._cursor = storage.conn.cursor()
+
+    def execute(self, query, params=()):
+        self._storage.queries += 1
+        time.sleep(self._storage.latency)
+        self._cursor.execute(query.replace("%s", "?"), params)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+
+class FakeStorage(object):
+
+    def __init__(self, conn, latency):
+        self.conn = conn
+        self.latency = latency
+        self.queries = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return Cursor(self)
+
+
+def build_world(rooms):
+    conn = sqlite3.connect(":memory:")
+    conn.executescript("""
+        CREATE TABLE roomdef (id INTEGER PRIMARY KEY, name TEXT, description TEXT);
+        CREATE TABLE exitdef (id INTEGER PRIMARY KEY, fromroom INTEGER, name TEXT, toroom INTEGER,
+                              itemkey INTEGER, failkey TEXT);
+        CREATE TABLE objdef (id INTEGER PRIMARY KEY, name TEXT, description TEXT, movable INTEGER,
+                             failtake TEXT, takesuccess TEXT, takeitem INTEGER);
+        CREATE TABLE roominv (roomid INTEGER, objid INTEGER);
+        CREATE TABLE npcdef (id INTEGER PRIMARY KEY, name TEXT, description TEXT, code TEXT, arg TEXT);
+        CREATE TABLE roomnpc (roomid INTEGER, npcid INTEGER);
+        CREATE INDEX exitfrom ON exitdef (fromroom);
+        CREATE INDEX invroom ON roominv (roomid);
+        CREATE INDEX npcroom ON roomnpc (roomid);
+    """)
+    conn.executemany("INSERT INTO roomdef VALUES (?, ?, ?)",
+                     [(i, "Room {}".format(i), "A room.\nIt is room {}.".format(i)) for i in range(1, rooms + 1)])
+    conn.executemany("INSERT INTO exitdef (fromroom, name, toroom, itemkey, failkey) VALUES (?, ?, ?, 0, '')",
+                     [(i, name, (i + step - 1) % rooms + 1) for i in range(1, rooms + 1)
+                      for name, step in (("north", 1), ("south", -1))])
+    conn.executemany("INSERT INTO objdef VALUES (?, ?, ?, 1, '', 'Taken.', 1)",
+                     [(i, "object {}".format(i), "An object.") for i in range(1, 101)])
+    conn.executemany("INSERT INTO roominv VALUES (?, ?)",
+                     [(i, (i + j) % 100 + 1) for i in range(1, rooms + 1) for j in range(i % 3)])
+    conn.executemany("INSERT INTO npcdef VALUES (?, ?, ?, 'talk', 'Hello.')",
+                     [(i, "npc {}".format(i), "Someone.") for i in range(1, 21)])
+    conn.executemany("INSERT INTO roomnpc VALUES (?, ?)",
+                     [(i, i % 20 + 1) for i in range(1, rooms + 1, 5)])
+    conn.commit()
+    return conn
+
+
+def legacy_load(db):
+    with db.connection() as mydb:
+        mycursor = mydb.cursor()
+        mycursor.execute("SELECT id, name, description FROM roomdef")
+        myresult = mycursor.fetchall()
+
+        rooms = []
+
+        for row in myresult:
+            room = {'id': row[0], 'name': row[1], 'description': row[2].replace('\n', '\n\r'), 'exits': [], 'items': [],
+                    'npcs': []}
+            mycursor.execute("SELECT id, name, toroom, itemkey, failkey FROM exitdef WHERE fromroom = %s", (row[0],))
+            for exrow in mycursor.fetchall():
+                room['exits'].append({'name': exrow[1], 'toroom': exrow[2], 'itemkey': exrow[3], 'failkey': exrow[4]})
+            rooms.append(room)
+
+    for room in rooms:
+        with db.connection() as mydb:
+            mycursor = mydb.cursor()
+            mycursor.execute("SELECT objid FROM roominv WHERE roomid = %s", (room['id'],))
+            for row in mycursor.fetchall():
+                mycursor.execute("SELECT name, description, movable, failtake, takesuccess, takeitem FROM objdef "
+                                 "WHERE id = %s", (row[0],))
+                objrow = mycursor.fetchone()
+                room['items'].append(
+                    {'id': row[0], 'name': objrow[0], 'description': objrow[1].replace('\n', '\n\r'),
+                     'movable': objrow[2], 'failtake': objrow[3], 'takesuccess': objrow[4], 'takeitem': objrow[5]})
+            mycursor.execute("SELECT npcid FROM roomnpc WHERE roomid = %s", (room['id'],))
+            for row in mycursor.fetchall():
+                mycursor.execute("SELECT name, description, code, arg FROM npcdef WHERE id = %s", (row[0],))
+                npcrow = mycursor.fetchone()
+                room['npcs'].append({'id': row[0], 'name': npcrow[0], 'description': npcrow[1].replace('\n', '\n\r'),
+                                     'code': npcrow[2], 'arg': npcrow[3]})
+
+    return rooms
+
+
+def as_dict(room):
+    # the old loader's layout, for comparing the two
+    def fields(obj):
+        return dict((name, getattr(obj, name)) for name in type(obj).__slots__)
+
+    return {'id': room.id, 'name': room.name, 'description': room.description,
+            'exits': [fields(ex) for ex in room.exits], 'items': [fields(it) for it in room.items],
+            'npcs': [fields(npc) for npc in room.npcs]}
+
+
+def run(name, loader, db):
+    db.queries = 0
+    start = time.perf_counter()
+    rooms = loader(db)
+    elapsed = time.perf_counter() - start
+    print("{:>10}: {:8.1f} ms, {:6} queries".format(name, elapsed * 1000, db.queries))
+    return rooms
+
+
+def main():
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.2 / 1000
+
+    db = FakeStorage(build_world(rooms), latency)
+    print("{} rooms, {:.1f} ms simulated round trip".format(rooms, latency * 1000))
+
+    old = run("legacy", legacy_load, db)
+    new = run("load_world", load_world, db)
+    # exits are compared without regard to order, as the old loader didn't
+    # ask for any particular one
+    for a, b in zip(old, new.values()):
+        b = as_dict(b)
+        for room in (a, b):
+            room['exits'].sort(key=lambda e: e['name'])
+        assert a == b, "loaders disagree"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "world.snapshot")
+        save_snapshot(new, path)
+        snapshot = run("snapshot", lambda db: load_snapshot(path), db)
+    assert [as_dict(room) for room in snapshot.values()] == [as_dict(room) for room in new.values()], \
+        "snapshot differs from the database"
+
+
+if __name__ == "__main__":
+    main()
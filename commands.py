@@ -0,0 +1,143 @@
+"""Command dispatch for starliner.py.
+
+Contains CommandTable, which maps the commands players type, their
+aliases and their abbreviations to the functions that handle them, and
+CommandTimer, which can be given to a CommandTable to record how often
+each command is used and how long it takes.
+"""
+
+import time
+
+
+class CommandTimer(object):
+    """Records the number of calls and the time taken by each command.
+
+    A CommandTable given a CommandTimer calls it with the command's name
+    and the seconds it took every time a command is handled.
+    """
+
+    def __init__(self):
+        # maps command names to [calls, total seconds, longest seconds]
+        self.stats = {}
+
+    def __call__(self, name, seconds):
+        stat = self.stats.get(name)
+        if stat is None:
+            self.stats[name] = [1, seconds, seconds]
+        else:
+            stat[0] += 1
+            stat[1] += seconds
+            if seconds > stat[2]:
+                stat[2] = seconds
+
+    def report(self):
+        """Returns a list of lines describing each command's calls and
+        times, the command with the most total time first.
+        """
+        lines = []
+        for name, (calls, total, longest) in sorted(self.stats.items(), key=lambda s: -s[1][1]):
+            lines.append("{:>12}: {:8} calls, {:10.1f} ms total, {:8.3f} ms mean, {:8.3f} ms max".format(
+                name, calls, total * 1000, total / calls * 1000, longest * 1000))
+        return lines
+
+    def reset(self):
+        """Forgets everything recorded so far."""
+        self.stats = {}
+
+
+class CommandTable(object):
+    """Finds the function which handles a command.
+
+    Commands are added with 'add', along with any aliases. Any
+    shortening of a command's name or alias which doesn't also shorten a
+    different command is accepted as well, e.g. 'inv' for 'inventory',
+    unless the command was added with 'abbreviate' set to False. Every
+    possible shortening is worked out in advance, so looking up a
+    command is a single dictionary lookup.
+
+    If 'timer' is given, such as a CommandTimer, it is called with the
+    command's name and how long the handler took after every command.
+    The name is preceded by 'label', if given, so that tables sharing a
+    timer can be told apart.
+    """
+
+    def __init__(self, timer=None, label=None):
+        self.timer = timer
+        self.label = label
+        # maps command names to their handlers, in the order they were added
+        self._handlers = {}
+        # maps each alias to the name of the command it stands for
+        self._aliases = {}
+        # names of the commands which must be typed in full
+        self._unabbreviated = set()
+        # maps every name, alias and abbreviation to (name, handler), built
+        # when first needed after a command is added
+        self._lookup = None
+
+    def add(self, name, handler, aliases=(), abbreviate=True):
+        """Makes 'handler' handle the command 'name' and any of the
+        'aliases' given. If 'abbreviate' is False, the command is only
+        recognised when its name or an alias is typed in full, which
+        stops a slip of the keyboard running a command that can't be
+        undone.
+        """
+        self._handlers[name] = handler
+        for alias in aliases:
+            self._aliases[alias] = name
+        if abbreviate:
+            self._unabbreviated.discard(name)
+        else:
+            self._unabbreviated.add(name)
+        self._lookup = None
+
+    def dispatch(self, command, *args):
+        """Calls the handler for 'command' with 'args'. Returns False,
+        without calling anything, if there is no such command.
+        """
+        found = self._table().get(command)
+        if found is None:
+            return False
+
+        name, handler = found
+        if self.timer is None:
+            handler(*args)
+        else:
+            start = time.perf_counter()
+            try:
+                handler(*args)
+            finally:
+                self.timer(name if self.label is None else self.label + " " + name,
+                           time.perf_counter() - start)
+        return True
+
+    def _table(self):
+        if self._lookup is None:
+            self._lookup = self._build()
+        return self._lookup
+
+    def _build(self):
+        words = dict((name, name) for name in self._handlers)
+        words.update(self._aliases)
+
+        # count which commands each shortening could stand for, and keep
+        # the ones which stand for only one
+        prefixes = {}
+        for word, name in words.items():
+            for end in range(1, len(word)):
+                prefixes.setdefault(word[:end], set()).add(name)
+
+        # a command which can't be shortened still stops its shortenings
+        # from standing for anything else, so that e.g. 'q' doesn't start
+        # meaning some other command
+        lookup = {}
+        for prefix, names in prefixes.items():
+            if len(names) == 1:
+                name = names.pop()
+                if name not in self._unabbreviated:
+                    lookup[prefix] = (name, self._handlers[name])
+
+        # full names and aliases always win over shortenings of other
+        # commands
+        for word, name in words.items():
+            lookup[word] = (name, self._handlers[name])
+        return lookup
@@ -0,0 +1,109 @@
+"""Configuration for starliner.py.
+
+Contains Config, which reads the server's settings from a JSON file
+once at startup, lets environment variables override them, and can be
+told to read them again while the server is running.
+"""
+
+import json
+import os
+
+
+class Config(object):
+    """Settings for the server, read from a JSON file such as db.json.
+
+    Settings are looked up like a dictionary, e.g. config['host']. Any
+    setting can be overridden by an environment variable named after it
+    in upper case with a 'STARLINER_' prefix, e.g. STARLINER_HOST or
+    STARLINER_POOL_SIZE. Environment values are converted to the type of
+    the setting's default value.
+    """
+
+    ENV_PREFIX = "STARLINER_"
+
+    # settings used when they are missing from both the file and the
+    # environment
+    DEFAULTS = {
+        # which kind of database the game is kept in, 'mysql' or 'sqlite'.
+        # The rest of the database settings are for MySQL, apart from
+        # sqlite_path, the SQLite database file
+        'database_type': 'mysql',
+        'sqlite_path': 'starliner.db',
+        'host': 'localhost',
+        'username': 'mud',
+        'password': '',
+        'database': 'mud',
+        'pool_size': 5,
+        # the longest time, in seconds, that a player state change can wait
+        # before being written to the database, and how many changes can
+        # build up before they are written early
+        'writebehind_interval': 1.0,
+        'writebehind_max_pending': 500,
+        # how many processes hash and check passwords, and the bcrypt cost
+        # factor used for new password hashes
+        'auth_workers': 2,
+        'bcrypt_rounds': 12,
+        # whether to read every item definition at startup, and how many to
+        # keep in memory (0 for no limit)
+        'item_cache_preload': True,
+        'item_cache_size': 0,
+        # a world snapshot file, built with 'python world.py', to load the
+        # rooms from instead of the database (empty for none)
+        'world_snapshot': '',
+        # how often, in seconds, to print how many times each command has
+        # been used and how long it took (0 to not time commands)
+        'command_timing': 0.0,
+    }
+
+    def __init__(self, path='db.json', environ=None):
+        """Constructs the Config object and reads the settings from the
+        file at 'path'. 'environ' defaults to os.environ.
+        """
+        self.path = path
+        self._environ = os.environ if environ is None else environ
+        self._values = {}
+        self.reload()
+
+    def reload(self):
+        """Reads the settings again from the file and the environment. If
+        the file can't be read, or a setting can't be converted, the error
+        is raised and the settings are left as they were.
+        """
+        with open(self.path, 'r') as openfile:
+            values = dict(self.DEFAULTS)
+            values.update(json.load(openfile))
+
+        for name in list(values):
+            env = self._environ.get(self.ENV_PREFIX + name.upper())
+            if env is not None:
+                values[name] = self._convert(env, self.DEFAULTS.get(name))
+
+        self._values = values
+
+    def snapshot(self):
+        """Returns the current settings, to be put back with 'restore'."""
+        return self._values
+
+    def restore(self, snapshot):
+        """Puts back the settings returned by 'snapshot'."""
+        self._values = snapshot
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def _convert(self, value, like):
+        # environment variables are always strings, so turn them into the
+        # same type as the default
+        if isinstance(like, bool):
+            return value.lower() in ('1', 'true', 'yes', 'on')
+        if isinstance(like, int):
+            return int(value)
+        if isinstance(like, float):
+            return float(value)
+        return value
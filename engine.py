@@ -0,0 +1,704 @@
+"""The game played on starliner.py's server.
+
+Contains Engine, which holds the state of the game (the players online,
+the rooms of the world and who is in each room) and decides what
+happens when players connect, type commands and leave. It doesn't talk
+to the network itself: each of its methods returns a list of output
+events describing what should be sent to whom, which a transport from
+transports.py carries out. This means the game can be run, tested and
+benchmarked in-process with an in-memory transport.
+"""
+
+from commands import CommandTable
+from models import Player
+from world import Occupancy
+
+
+class Engine(object):
+    """The game logic of starliner.py.
+
+    'rooms' is the world, as returned by world.load_world. 'storage' is
+    used to load and save players, as storage.Storage does, 'writes' to
+    queue routine changes to them, as storage.WriteBehind does, and
+    'auth' to hash and check passwords, as auth.Authenticator does.
+    'motd' is the lines of the message shown to players when they
+    connect. If 'timer' is given, such as a commands.CommandTimer, it
+    records how long each command takes.
+
+    Input is passed to 'on_connect', 'on_disconnect' and
+    'handle_command', which each return a list of output events. Each
+    event is a tuple whose first item is one of:
+
+        SEND: (SEND, id, message, color, auth, lineend)
+        BROADCAST: (BROADCAST, ids, message, color, auth, lineend, exclude)
+        AUTHENTICATE: (AUTHENTICATE, id)
+        TOGGLECOLOR: (TOGGLECOLOR, id)
+        DISCONNECT: (DISCONNECT, id)
+
+    with the same meanings as the MudServer methods of the same names.
+    Output from password checks finishing in the background is collected
+    until the next call, or until 'take_output' is called.
+    """
+
+    # input events, as returned by a transport's 'poll'
+    NEW_PLAYER = 1
+    PLAYER_LEFT = 2
+    COMMAND = 3
+
+    # output events
+    SEND = "send_message"
+    BROADCAST = "broadcast"
+    AUTHENTICATE = "authenticate"
+    TOGGLECOLOR = "togglecolor"
+    DISCONNECT = "disconnect"
+
+    # how many commands are kept for a player who types while their
+    # password is being checked. Any more are ignored
+    MAX_WAITING = 20
+
+    def __init__(self, rooms, storage, writes, auth, motd=(), timer=None):
+        self.rooms = rooms
+        self.db = storage
+        self.writes = writes
+        self.auth = auth
+        self.motd = list(motd)
+
+        # stores the players in the game
+        self.players = {}
+        # stores which players are in each room
+        self.occupancy = Occupancy()
+
+        self._output = []
+
+        # each of the possible commands is handled by one of the methods
+        # below, which are called with the player's id and whatever they
+        # typed after the command. Commands which can't be undone have to be
+        # typed in full. Try adding new commands to the game!
+        self.commands = CommandTable(timer)
+        self.commands.add("quit", self._do_quit, abbreviate=False)
+        self.commands.add("help", self._do_help)
+        self.commands.add("say", self._do_say)
+        self.commands.add("color", self._do_color)
+        self.commands.add("drop", self._do_drop, abbreviate=False)
+        self.commands.add("take", self._do_take)
+        self.commands.add("inventory", self._do_inventory)
+        self.commands.add("unequip", self._do_unequip)
+        self.commands.add("equip", self._do_equip)
+        self.commands.add("examine", self._do_examine, ("x",))
+        self.commands.add("look", self._do_look)
+        self.commands.add("go", self._do_go)
+        self.commands.add("target", self._do_target)
+
+        # commands for players talking to an NPC, one table for each kind of
+        # NPC. NPC CODE 1 = SCRAPBOT
+        scrapbot = CommandTable(timer, label="scrapbot")
+        scrapbot.add("help", self._scrapbot_help)
+        scrapbot.add("appraise", self._scrapbot_appraise)
+        scrapbot.add("scrap", self._scrapbot_scrap, abbreviate=False)
+        self.npccommands = {1: scrapbot}
+
+    def process(self, transport):
+        """Fetches the next batch of input from 'transport', handles it,
+        and gives the transport the output to carry out.
+        """
+        for event in transport.poll():
+            if event[0] == self.NEW_PLAYER:
+                transport.send(self.on_connect(event[1]))
+            elif event[0] == self.PLAYER_LEFT:
+                transport.send(self.on_disconnect(event[1]))
+            elif event[0] == self.COMMAND:
+                transport.send(self.handle_command(*event[1:]))
+        # anything said by password checks which finished while waiting
+        transport.send(self.take_output())
+
+    def on_connect(self, id):
+        """Handles a new player connecting with id number 'id'. Returns
+        the output events.
+        """
+        # add the new player to the dictionary, noting that they've not been
+        # named yet.
+        # The dictionary key is the player's id number. We set their room to
+        # None initially until they have entered a name
+        # Try adding more player stats to models.Player - level, mana, etc
+        self.players[id] = Player()
+
+        for l in self.motd:
+            self._send(id, l, auth=False)
+
+        # send the new player a prompt for their name
+        self._send(id, "What is your name? (or 'new' for a new player)", auth=False)
+        return self.take_output()
+
+    def on_disconnect(self, id):
+        """Handles the player with id number 'id' disconnecting. Returns
+        the output events.
+        """
+        # anything still waiting to be sent to the player is thrown away, as
+        # they are no longer there to receive it
+        self._output = [event for event in self._output if event[0] == self.BROADCAST or event[1] != id]
+
+        # if for any reason the player isn't in the player map, there's
+        # nothing to do
+        if id not in self.players:
+            return self.take_output()
+
+        # send each other player a message to tell them about the
+        # disconnected player
+        if self.players[id].password and not self.players[id].authenticating:
+            self._broadcast(self.players, "%bold%yellow{} quit the game".format(
+                self.players[id].name), exclude=id)
+
+        # remove the player from their room and the player dictionary, and
+        # have their latest state written to the database now
+        self.occupancy.remove(id, self.players[id].room)
+        del (self.players[id])
+        self.writes.flush()
+        return self.take_output()
+
+    def handle_command(self, id, command, params):
+        """Handles the player with id number 'id' typing 'command',
+        followed by 'params'. Returns the output events.
+        """
+        # if for any reason the player isn't in the player map, ignore them
+        if id in self.players:
+            self._command(id, command, params)
+        return self.take_output()
+
+    def take_output(self):
+        """Returns the output events produced since the last call."""
+        output = self._output
+        self._output = []
+        return output
+
+    def _send(self, id, message, color=None, auth=True, lineend="\r\n"):
+        self._output.append((self.SEND, id, message, color, auth, lineend))
+
+    def _broadcast(self, ids, message, color=None, auth=True, lineend="\r\n", exclude=None):
+        # the players to send to are copied, as they may move before the
+        # message is sent
+        self._output.append((self.BROADCAST, tuple(ids), message, color, auth, lineend, exclude))
+
+    def _authenticate(self, id):
+        self._output.append((self.AUTHENTICATE, id))
+
+    def _togglecolor(self, id):
+        self._output.append((self.TOGGLECOLOR, id))
+
+    def _disconnect(self, id):
+        self._output.append((self.DISCONNECT, id))
+
+    def _command(self, id, command, params):
+        player = self.players[id]
+
+        # if the player hasn't given their name yet, use this first command as
+        # their name and move them to the starting room.
+        if player.name is None:
+
+            if command.lower() == "new":
+                player.newplayer = True
+                self._send(id, "What would you like your name to be?", auth=False)
+            else:
+                if player.newplayer:
+                    if self._checkname(command):
+                        player.name = command
+                        self._send(id, "Choose a password?", auth=False)
+                    else:
+                        self._send(id, "Sorry, that name is in use or inappropriate, try again.", 'red',
+                                   auth=False)
+                else:
+                    player.name = command
+                    self._send(id, "What is your password? ", auth=False)
+
+        elif player.password is None:
+            if len(command) < 8 and player.newplayer:
+                self._send(id, "Password too short!", 'red', auth=False)
+                self._send(id, "Choose a password?", auth=False)
+                return
+
+            player.password = command
+
+            # only one connection can be playing as each player
+            for pid, pl in self.players.items():
+                if pid != id and pl.name == player.name:
+                    self._disconnect(id)
+                    return
+
+            # the password is checked or hashed in the background. Until the
+            # result comes back the player waits and their commands are kept
+            # for later, while everyone else carries on playing
+            player.authenticating = True
+            if not player.newplayer:
+                row = self.db.load_player(player.name)
+                if row is None:
+                    del (self.players[id])
+                    self._disconnect(id)
+                    return
+                self.auth.check_password(command, row['password'], self._finishlogin, id, row)
+            else:
+                self.auth.hash_password(command, self._finishnewplayer, id)
+
+        elif player.authenticating:
+            if len(player.waiting) < self.MAX_WAITING:
+                player.waiting.append((command, params))
+
+        elif player.target is not None:
+            if command == "bye":
+                player.target = None
+            elif player.target.code in self.npccommands:
+                self.npccommands[player.target.code].dispatch(command, id, params)
+            self._prompt(id)
+        else:
+            if not self.commands.dispatch(command, id, params):
+                # send back an 'unknown command' message
+                self._send(id, "Unknown command '{}'".format(command))
+            self._prompt(id)
+
+    def _putattrib(self, pid, attrib, value):
+        # written to the database in the background
+        self.writes.set_attrib(pid, attrib, value)
+
+    def _loadplayer(self, player, row):
+        # fill in the player from what Storage.load_player returned
+        dbid = row['id']
+
+        # changes still waiting to be written take priority over what was read
+        def getattrib(attrib, defvalue):
+            return self.writes.pending(('attrib', dbid, attrib), row['attribs'].get(attrib, defvalue))
+
+        player.dbid = dbid
+        player.room = self.writes.pending(('room', dbid), row['lastroom'])
+        player.inventory.extend(row['inventory'])
+        player.health = int(getattrib("health", "100"))
+        player.gold = int(getattrib("gold", "0"))
+        player.color = self._str2bool(getattrib("color", "True"))
+        a = int(getattrib("armor", "0"))
+        if a != 0:
+            player.armor = row['items'][a] if a in row['items'] else self._loaditem(a)
+        w = int(getattrib("weapon", "0"))
+        if w != 0:
+            player.weapon = row['items'][w] if w in row['items'] else self._loaditem(w)
+
+    def _checkname(self, name):
+        if name.lower() == "new":
+            return False
+        elif not name.isalnum():
+            return False
+        elif len(name) < 2:
+            return False
+        else:
+            return not self.db.name_taken(name)
+
+    def _updateplayerroom(self, player):
+        # written to the database in the background
+        self.writes.set_room(player.dbid, player.room)
+
+    def _instplayer(self, player, hashed):
+        player.dbid = self.db.create_player(player.name, hashed)
+
+    def _loaditem(self, itemid):
+        # item definitions are shared, so this is usually just a lookup
+        return self.db.items.get(itemid)
+
+    def _str2bool(self, v):
+        if v == "True":
+            return True
+        return False
+
+    def _findroom(self, id):
+        rm = self.rooms.get(id)
+        if rm is None:
+            # players in a room that no longer exists are put in the first room
+            rm = next(iter(self.rooms.values()))
+            print("Room {} not found, using room {} instead".format(id, rm.id))
+        return rm
+
+    def _cmd_look(self, id, rm):
+        # send the player back the description of their current room
+        self._send(id, "\n\r%bold%cyan" + rm.name + "\r\n")
+        self._send(id, rm.description + "\r\n")
+
+        playershere = []
+        # go through every player in the same room as the player
+        for pid in self.occupancy.players_in(self.players[id].room):
+            # add their name to the list
+            playershere.append(self.players[pid].name)
+
+        # send player a message containing the list of self.players in the room
+        self._send(id, "%cyanPlayers: %reset{}".format(
+            ", ".join(playershere)))
+
+        # send player a message containing the list of exits from this room
+        exitshere = []
+        for ex in rm.exits:
+            exitshere.append(ex.name)
+
+        self._send(id, "%cyanExits: %reset{}".format(
+            ", ".join(exitshere)))
+
+        itemshere = []
+        for it in rm.items:
+            itemshere.append(it.name)
+
+        self._send(id, "%cyanObjects: %reset{}".format(", ".join(itemshere)))
+
+        npcshere = []
+        for it in rm.npcs:
+            npcshere.append(it.name)
+
+        self._send(id, "%cyanNPCs: %reset{}".format(", ".join(npcshere)))
+
+    def _finishlogin(self, ok, id, row):
+        # called once an existing player's password has been checked. The player
+        # may have disconnected while they were waiting
+        if id not in self.players:
+            return
+        if not ok:
+            del (self.players[id])
+            self._disconnect(id)
+            return
+
+        self._loadplayer(self.players[id], row)
+        if not self.players[id].color:
+            self._togglecolor(id)
+        self._enterworld(id)
+
+    def _finishnewplayer(self, hashed, id):
+        # called once a new player's password has been hashed
+        if id not in self.players:
+            return
+        if hashed is None:
+            del (self.players[id])
+            self._disconnect(id)
+            return
+
+        self.players[id].room = 1
+        self.players[id].health = 100
+        self.players[id].gold = 0
+        self._instplayer(self.players[id], hashed)
+        self._enterworld(id)
+
+    def _enterworld(self, id):
+        player = self.players[id]
+        player.authenticating = False
+        self._authenticate(id)
+        self.occupancy.add(id, player.room)
+
+        # send each player a message to tell them about the new player
+        self._broadcast(self.players, "%bold%yellow{} entered the game".format(
+            player.name))
+
+        # send the new player a welcome message
+        self._send(id, "Welcome to the game, {}. ".format(
+            player.name)
+                   + "Type 'help' for a list of commands. Have fun!\r\n", 'magenta')
+
+        # send the new player the description of their current room
+        rm = self._findroom(player.room)
+
+        self._cmd_look(id, rm)
+        self._prompt(id)
+
+        # now run anything they typed while they were waiting
+        waiting = player.waiting
+        player.waiting = []
+        for command, params in waiting:
+            self._command(id, command, params)
+
+    def _prompt(self, id):
+        player = self.players[id]
+        # show the player their status, and who they're talking to if anyone
+        if player.target is not None:
+            self._send(id, "\n\r{} -> {} [%bold%yellow{} gold%reset] [%bold%red{} HP%reset] :> ".format(
+                player.name, player.target.name, player.gold, player.health),
+                       lineend="")
+        else:
+            self._send(id, "\n\r{} [%bold%yellow{} gold%reset] [%bold%red{} HP%reset] :> ".format(
+                player.name, player.gold, player.health), lineend="")
+
+    def _scrapbot_help(self, id, params):
+        self._send(id, "I am a scrapbot, I turn unwanted items into gold!", lineend="\n\r\n\r")
+        self._send(id, "I answer to the following commands:")
+        self._send(id, "  appraise <item> - tell you how much <item> is worth.")
+        self._send(id, "                    eg: 'appraise sword'")
+        self._send(id, "  scrap <item>    - make the exchange. THIS CAN NOT BE UNDONE! ")
+        self._send(id, "                    eg: 'scrap sword'")
+        self._send(id, "  bye             - leave me in peace.")
+
+    def _scrapbot_appraise(self, id, params):
+        ex = params.lower()
+        found = False
+        for it in self.players[id].inventory:
+            if it.name == ex:
+                if it.basevalue > 0:
+                    val = int(it.basevalue * 0.10)
+                    self._send(id, "That {} looks like it's worth {} gold".format(it.name, val))
+                else:
+                    self._send(id, "That item has no value!")
+
+                found = True
+                break
+        if not found:
+            self._send(id, "appraise what?")
+
+    def _scrapbot_scrap(self, id, params):
+        player = self.players[id]
+        ex = params.lower()
+        found = False
+        for it in player.inventory:
+            if it.name == ex:
+                if it.basevalue > 0:
+                    val = int(it.basevalue * 0.10)
+                    with self.db.unit_of_work() as work:
+                        work.remove_inventory(player.dbid, it.id)
+                        work.set_attrib(player.dbid, "gold", str(player.gold + val))
+                    player.gold += val
+                    self._send(id, "Here's {} gold for your {}".format(val, it.name))
+                    player.inventory.remove(it)
+                else:
+                    self._send(id, "That item has no value!")
+
+                found = True
+                break
+        if not found:
+            self._send(id, "scrap what?")
+
+    def _do_quit(self, id, params):
+        self._disconnect(id)
+
+    def _do_help(self, id, params):
+        # send the player back the list of possible commands
+        self._send(id, "Commands:")
+        self._send(id, "  say <message>          - Says something out loud, "
+                   + "e.g. 'say Hello'")
+        self._send(id, "  look                   - Examines the "
+                   + "surroundings, e.g. 'look'")
+        self._send(id, "  examine <item>         - Examines an "
+                   + "item, e.g. 'examine fireplace'")
+        self._send(id, "  inventory              - Lists your inventory")
+        self._send(id, "  equip <item>           - Equip an "
+                   + "item, e.g. 'equip sword'")
+        self._send(id, "  unequip <weapon/armor> - Remove your currently "
+                   + "equipped weapon or armor")
+        self._send(id, "                           e.g. 'unequip weapon'")
+        self._send(id, "  take <item>            - Take an "
+                   + "item, e.g. 'take fireplace'")
+        self._send(id, "  drop <item>            - Destroy an inventory "
+                   + "item")
+        self._send(id, "  go <exit>              - Moves through the exit "
+                   + "specified, e.g. 'go outside'")
+        self._send(id, "  color <on/off>         - Turns color on or off, e.g. 'color off'")
+        self._send(id, "  quit                   - Disconnects from the game")
+        self._send(id, "Commands can be shortened, e.g. 'inv' for 'inventory', apart from quit and drop")
+
+    def _do_say(self, id, params):
+        player = self.players[id]
+        # send every player in the same room a message telling them
+        # what the player said
+        self._broadcast(self.occupancy.players_in(player.room), "%bold%blue{} says: {}".format(
+            player.name, params))
+
+    def _do_color(self, id, params):
+        player = self.players[id]
+        ex = params.lower()
+        if ex == "off":
+            if player.color:
+                self._putattrib(player.dbid, "color", "False")
+                self._togglecolor(id)
+                player.color = False
+        else:
+            if not player.color:
+                self._putattrib(player.dbid, "color", "True")
+                self._togglecolor(id)
+                player.color = True
+
+    def _do_drop(self, id, params):
+        player = self.players[id]
+        ex = params.lower()
+        found = False
+        for it in player.inventory:
+            if it.name == ex:
+                found = True
+                if not it.invulnerable:
+                    with self.db.unit_of_work() as work:
+                        work.remove_inventory(player.dbid, it.id)
+                    self._send(id, "You dropped {} and it vanished in thin air!".format(it.name))
+                    player.inventory.remove(it)
+                else:
+                    self._send(id, "You can't drop {}".format(it.name))
+                break
+        if not found:
+            self._send(id, "You have no {} to drop".format(ex))
+
+    def _do_take(self, id, params):
+        player = self.players[id]
+        rm = self._findroom(player.room)
+        it = rm.itemsbyname.get(params.lower())
+
+        if it is None:
+            self._send(id, "take what?!")
+        elif not it.movable:
+            self._send(id, it.failtake)
+        else:
+            failtake = False
+            for uniq in player.inventory:
+                if uniq.id == it.takeitem and uniq.isuniq:
+                    failtake = True
+                    break
+            if not failtake:
+                with self.db.unit_of_work() as work:
+                    work.add_inventory(player.dbid, it.takeitem)
+                self._send(id, it.takesuccess)
+                player.inventory.append(self._loaditem(it.takeitem))
+            else:
+                self._send(id, it.failtake)
+
+    def _do_inventory(self, id, params):
+        player = self.players[id]
+        if player.weapon is not None:
+            self._send(id, "%greenYour Weapon: %reset{}".format(player.weapon.name))
+        else:
+            self._send(id, "%greenYour Weapon: %resetNone")
+        if player.armor is not None:
+            self._send(id, "%greenYour Armor: %reset{}".format(player.armor.name))
+        else:
+            self._send(id, "%greenYour Armor: %resetNone")
+        self._send(id, "%greenYour Inventory:")
+        for item in player.inventory:
+            self._send(id, " - {}".format(item.name))
+
+    def _do_unequip(self, id, params):
+        player = self.players[id]
+        ex = params.lower()
+        if ex in ("armor", "weapon"):
+            it = getattr(player, ex)
+            if it is not None:
+                # the item goes back in the inventory and the slot is emptied
+                # in one transaction, so the item can't be lost or doubled
+                with self.db.unit_of_work() as work:
+                    work.add_inventory(player.dbid, it.id)
+                    work.set_attrib(player.dbid, ex, "0")
+                self._send(id, "You remove your {}".format(it.name))
+                player.inventory.append(it)
+                setattr(player, ex, None)
+            elif ex == "armor":
+                self._send(id, "%redYou're not wearing any armor!")
+            else:
+                self._send(id, "%redYou're not wielding a weapon!")
+        else:
+            self._send(id, "Parameter must be either 'weapon' or 'armor'")
+
+    def _do_equip(self, id, params):
+        player = self.players[id]
+        ex = params.lower()
+        found = False
+        for it in player.inventory:
+            if it.name == ex:
+                found = True
+                if it.isarmor or it.isweapon:
+                    slot = "armor" if it.isarmor else "weapon"
+                    # swapping out whatever was there before, equipping the
+                    # new item and taking it out of the inventory are saved
+                    # in one transaction
+                    old = getattr(player, slot)
+                    with self.db.unit_of_work() as work:
+                        if old is not None:
+                            work.add_inventory(player.dbid, old.id)
+                        work.set_attrib(player.dbid, slot, it.id)
+                        work.remove_inventory(player.dbid, it.id)
+                    if old is not None:
+                        player.inventory.append(old)
+                    setattr(player, slot, it)
+                    self._send(id, "You equip your {}".format(it.name))
+                    player.inventory.remove(it)
+                else:
+                    self._send(id, "That item is not able to be equipped")
+                break
+
+        if not found:
+            self._send(id, "equip what?!")
+
+    def _do_examine(self, id, params):
+        player = self.players[id]
+        rm = self._findroom(player.room)
+        ex = params.lower()
+
+        it = rm.itemsbyname.get(ex)
+
+        if it is None:
+            for inv in player.inventory:
+                if inv.name == ex:
+                    it = inv
+                    break
+
+        if it is None:
+            it = rm.npcsbyname.get(ex)
+
+        if it is not None:
+            self._send(id, it.description)
+        else:
+            self._send(id, "examine what?!")
+
+    def _do_look(self, id, params):
+        # store the player's current room
+        rm = self._findroom(self.players[id].room)
+
+        self._cmd_look(id, rm)
+
+    def _do_go(self, id, params):
+        player = self.players[id]
+        # store the exit name
+        ex = params.lower()
+
+        # store the player's current room
+        rm = self._findroom(player.room)
+        rex = rm.exitsbyname.get(ex)
+        # if the specified exit is found in the room's exits
+        if rex is not None:
+            key = True
+            if rex.itemkey != 0:
+                key = False
+                for ite in player.inventory:
+                    if ite.id == rex.itemkey:
+                        key = True
+                        break
+            if key:
+                # send the other self.players in the room a message telling
+                # them that the player left the room
+                self._broadcast(self.occupancy.players_in(player.room),
+                                "%bold%yellow{} left via exit '{}'".format(player.name, rex.name),
+                                exclude=id)
+
+                # update the player's current room to the one the exit leads to
+                self.occupancy.move(id, player.room, rex.toroom)
+                player.room = rex.toroom
+                rm = self._findroom(player.room)
+
+                # send the other self.players in the new room a message telling
+                # them that the player entered the room
+                self._broadcast(self.occupancy.players_in(player.room),
+                                "%bold%yellow{} arrived via exit '{}'".format(player.name, rex.name),
+                                exclude=id)
+
+                # send the player a message telling them where they are now
+                self._send(id, "You arrive at '{}'".format(rm.name))
+
+                self._updateplayerroom(player)
+            else:
+                self._send(id, "{}".format(rex.failkey))
+        # the specified exit wasn't found in the current room
+        else:
+            # send back an 'unknown exit' message
+            self._send(id, "Unknown exit '{}'".format(ex))
+
+    def _do_target(self, id, params):
+        player = self.players[id]
+        ex = params.lower()
+        rm = self._findroom(player.room)
+        it = rm.npcsbyname.get(ex)
+
+        if it is not None:
+            player.target = it
+            self._send(id, "Now targeting %bold{}%reset enter 'bye' to stop targeting.".format(
+                it.name))
+        else:
+            self._send(id, "I see no such NPC")
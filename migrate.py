@@ -0,0 +1,85 @@
+"""Copies the game's database from MySQL into an SQLite file.
+
+Reads every table the game uses from the MySQL database configured in
+db.json and writes it to an SQLite database file, creating the tables
+there first if need be. Anything already in those tables in the SQLite
+file is replaced. Once it has finished, set 'database_type' to 'sqlite'
+and 'sqlite_path' to the file to run the server from it.
+
+usage: python migrate.py [db.json] [sqlite file]
+"""
+
+import sys
+import time
+
+from config import Config
+from storage import SQLITE_SCHEMA, TABLES, SQLitePool, Storage
+
+# how many rows to copy at a time
+BATCH = 1000
+
+
+def migrate(source, target):
+    """Copies every table from 'source', a Storage, to 'target', an
+    SQLitePool, in a single transaction. Returns a dictionary of how
+    many rows were copied for each table.
+    """
+    counts = {}
+    with source.connection() as srcdb, target.connection() as dstdb:
+        dstdb.executescript(SQLITE_SCHEMA)
+        dstdb.start_transaction()
+        try:
+            srccursor = srcdb.cursor()
+            dstcursor = dstdb.cursor()
+            for table in TABLES:
+                dstcursor.execute("DELETE FROM " + table)
+
+                # only copy the columns that both databases have
+                srccursor.execute("SELECT * FROM " + table + " LIMIT 0")
+                srccursor.fetchall()
+                columns = [d[0] for d in srccursor.description]
+                dstcursor.execute("PRAGMA table_info(" + table + ")")
+                known = set(row[1] for row in dstcursor.fetchall())
+                columns = [c for c in columns if c in known]
+
+                # rows are copied oldest first, and a row which clashes with
+                # a unique key in SQLite, such as a second value for the same
+                # player attribute, replaces the older one
+                insert = "INSERT OR REPLACE INTO {} ({}) VALUES({})".format(table, ", ".join(columns),
+                                                                            ", ".join(["%s"] * len(columns)))
+                srccursor.execute("SELECT " + ", ".join(columns) + " FROM " + table +
+                                  (" ORDER BY id" if "id" in columns else ""))
+                counts[table] = 0
+                while True:
+                    rows = srccursor.fetchmany(BATCH)
+                    if not rows:
+                        break
+                    dstcursor.executemany(insert, rows)
+                    counts[table] += len(rows)
+            dstdb.commit()
+        except Exception:
+            dstdb.rollback()
+            raise
+    return counts
+
+
+def main():
+    config = Config(sys.argv[1] if len(sys.argv) > 1 else 'db.json')
+    path = sys.argv[2] if len(sys.argv) > 2 else config['sqlite_path']
+
+    start = time.perf_counter()
+    source = Storage(config)
+    target = SQLitePool(path)
+    try:
+        counts = migrate(source, target)
+    finally:
+        source.close()
+        target.close()
+
+    for table in TABLES:
+        print("{:>12}: {} rows".format(table, counts[table]))
+    print("Copied the database to {} in {:.1f} s".format(path, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""The things that make up the game played on starliner.py's server.
+
+Contains Player, for a connected player, Room, Exit, WorldObject and
+NPC, which make up the world, and ItemDef, the definition of an item
+players can carry. Each has a fixed set of attributes declared with
+__slots__, so the thousands of them in a running game take far less
+memory than dictionaries would, and their attributes are quicker to
+read.
+"""
+
+
+class ItemDef(object):
+    """The definition of an item, read from the itemdef table.
+
+    Definitions can't be changed once made, as one definition is shared
+    by every inventory holding that item.
+    """
+
+    __slots__ = ('id', 'name', 'description', 'invulnerable', 'isuniq', 'isarmor', 'isweapon', 'power',
+                 'basevalue', 'bound')
+
+    def __init__(self, id, name, description, invulnerable, isuniq, isarmor, isweapon, power, basevalue, bound):
+        for attr, value in zip(ItemDef.__slots__, (id, name, description, invulnerable, isuniq, isarmor, isweapon,
+                                                   power, basevalue, bound)):
+            object.__setattr__(self, attr, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Item definitions can't be changed")
+
+    def __delattr__(self, name):
+        raise AttributeError("Item definitions can't be changed")
+
+    def __reduce__(self):
+        # rebuilt through __init__, as unpickling would otherwise set the
+        # attributes directly
+        return ItemDef, tuple(getattr(self, attr) for attr in ItemDef.__slots__)
+
+
+class Exit(object):
+    """A way out of a room, leading to room 'toroom'. If 'itemkey' isn't
+    0, players need that item to use it, and are told 'failkey' if they
+    don't have it.
+    """
+
+    __slots__ = ('name', 'toroom', 'itemkey', 'failkey')
+
+    def __init__(self, name, toroom, itemkey, failkey):
+        self.name = name
+        self.toroom = toroom
+        self.itemkey = itemkey
+        self.failkey = failkey
+
+    def __reduce__(self):
+        return Exit, (self.name, self.toroom, self.itemkey, self.failkey)
+
+
+class WorldObject(object):
+    """Something in a room which players can examine, and take if it is
+    'movable', giving them item 'takeitem'. 'takesuccess' and 'failtake'
+    are what they are told when taking it works and when it doesn't.
+    """
+
+    __slots__ = ('id', 'name', 'description', 'movable', 'failtake', 'takesuccess', 'takeitem')
+
+    def __init__(self, id, name, description, movable, failtake, takesuccess, takeitem):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.movable = movable
+        self.failtake = failtake
+        self.takesuccess = takesuccess
+        self.takeitem = takeitem
+
+    def __reduce__(self):
+        return WorldObject, (self.id, self.name, self.description, self.movable, self.failtake, self.takesuccess,
+                             self.takeitem)
+
+
+class NPC(object):
+    """A non-player character in a room. 'code' says what kind of NPC it
+    is, and so which commands it answers to.
+    """
+
+    __slots__ = ('id', 'name', 'description', 'code', 'arg')
+
+    def __init__(self, id, name, description, code, arg):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.code = code
+        self.arg = arg
+
+    def __reduce__(self):
+        return NPC, (self.id, self.name, self.description, self.code, self.arg)
+
+
+class Room(object):
+    """A room in the world, with lists of its exits, objects ('items')
+    and NPCs.
+
+    'exitsbyname', 'itemsbyname' and 'npcsbyname' map the lower case
+    name of each exit, object and NPC to it, so that commands can find
+    them without searching. Call 'index' after changing the lists to
+    bring these up to date.
+    """
+
+    __slots__ = ('id', 'name', 'description', 'exits', 'items', 'npcs', 'exitsbyname', 'itemsbyname',
+                 'npcsbyname')
+
+    def __init__(self, id, name, description, exits=None, items=None, npcs=None):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.exits = exits if exits is not None else []
+        self.items = items if items is not None else []
+        self.npcs = npcs if npcs is not None else []
+        self.index()
+
+    def __reduce__(self):
+        # the indexes are rebuilt rather than saved, keeping snapshots small
+        return Room, (self.id, self.name, self.description, self.exits, self.items, self.npcs)
+
+    def index(self):
+        """Rebuilds the name indexes. Where two things share a name, the
+        first one listed is used.
+        """
+        self.exitsbyname = self._index(self.exits)
+        self.itemsbyname = self._index(self.items)
+        self.npcsbyname = self._index(self.npcs)
+
+    def _index(self, entries):
+        index = {}
+        for entry in entries:
+            index.setdefault(entry.name.lower(), entry)
+        return index
+
+
+class Player(object):
+    """A connected player.
+
+    Until they have logged in, 'name' and 'password' are what they have
+    typed so far and 'room' is None. 'dbid' is their id in the database.
+    'armor' and 'weapon' are the ItemDefs they have equipped, if any,
+    'inventory' is a list of the ItemDefs they carry and 'target' is the
+    NPC they are talking to, if any. 'waiting' holds the (command,
+    params) pairs they typed while their password was being checked.
+    """
+
+    __slots__ = ('name', 'room', 'dbid', 'password', 'newplayer', 'authenticating', 'health', 'gold', 'color',
+                 'armor', 'weapon', 'target', 'inventory', 'waiting')
+
+    def __init__(self):
+        self.name = None
+        self.room = None
+        self.dbid = None
+        self.password = None
+        self.newplayer = False
+        self.authenticating = False
+        self.health = 100
+        self.gold = 0
+        self.color = True
+        self.armor = None
+        self.weapon = None
+        self.target = None
+        self.inventory = []
+        self.waiting = []
@@ -7,8 +7,12 @@ server running then used to send and receive messages from players.
 author: Mark Frimston - mfrimston@gmail.com
 """
 
+import collections
+import functools
+import heapq
+import re
 import socket
-import select
+import selectors
 import time
 import sys
 
@@ -43,6 +47,47 @@ def multiple_replace(text, replace_words, color_enabled=True):
     return text
 
 
+# matches any color code. The alternatives are in the same order as 'codes'
+# so that where one code is a prefix of another (e.g. '%bold' and
+# '%boldoff') the same one wins as in multiple_replace
+_color_pattern = re.compile('|'.join(re.escape('%' + c) for c in codes))
+_color_escapes = {'%' + c: get_color(c) for c in codes}
+
+
+@functools.lru_cache(maxsize=4096)
+def render_colors(text, color_enabled=True):
+    """Replaces the color codes in 'text' with escape sequences, or
+    removes them if 'color_enabled' is False. The result is the same as
+    multiple_replace(text, get_color_list(), color_enabled) but is made
+    in a single pass, and recently used strings are cached.
+    """
+    if color_enabled:
+        return _color_pattern.sub(lambda m: _color_escapes[m.group()], text)
+
+    result = _color_pattern.sub('', text)
+    # removing a code can join the text either side of it into a new code,
+    # which multiple_replace would go on to remove in a later pass
+    if _color_pattern.search(result):
+        return multiple_replace(text, get_color_list(), False)
+    return result
+
+
+class Timer(object):
+    """A callback scheduled with MudServer.call_later or
+    MudServer.call_every. Call 'cancel' to stop it running.
+    """
+
+    def __init__(self, callback, args, interval=None):
+        self.callback = callback
+        self.args = args
+        # seconds between runs for a repeating timer, None for a one-off
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
 class MudServer(object):
     """A basic server for text-based Multi-User Dungeon (MUD) games.
 
@@ -65,19 +110,39 @@ class MudServer(object):
         # the ip address of this client
         address = ""
         # holds data send from the client until a full message is received
-        buffer = ""
+        buffer = None
+        # which state the Telnet parser was in at the end of the last data
+        # received. See _process_sent_data function
+        read_state = 1
+        # the last will/wont/do/dont code seen, waiting for its option code
+        option_support = 0
         # the last time we checked if the client was still connected
         lastcheck = 0
         color_enabled = True
         authenticated = False
+        # holds data waiting to be written to the client's socket
+        outbuf = None
+        # when the client's outbound data first went over the high-water
+        # mark, or None if it is currently below it
+        lagging_since = None
+        # whether the selector is watching the socket for writability
+        want_write = False
+        # the timer which periodically checks the client is still connected
+        liveness = None
 
         def __init__(self, socket, address, buffer, lastcheck):
             self.socket = socket
             self.address = address
-            self.buffer = buffer
+            self.buffer = bytearray(buffer)
             self.lastcheck = lastcheck
+            self.read_state = MudServer._READ_STATE_NORMAL
+            self.option_support = 0
             self.MXP_ENABLED = False
             self.GMCP_ENABLED = False
+            self.outbuf = bytearray()
+            self.lagging_since = None
+            self.want_write = False
+            self.liveness = None
 
     # Used to store different types of occurences
     _EVENT_NEW_PLAYER = 1
@@ -104,8 +169,28 @@ class MudServer(object):
     _MXP = 91
     _GMCP = 201
 
+    # how often, in seconds, to check that clients are still connected
+    _LIVENESS_INTERVAL = 5.0
+    # with TCP keepalive, how many unanswered probes mean the client has gone
+    _KEEPALIVE_PROBES = 3
+
+    # the data attached to the wakeup socket in the selector
+    _WAKEUP = "wakeup"
+
+    # how many seconds to stop accepting new clients for when the server
+    # has run out of file descriptors
+    _ACCEPT_PAUSE = 1.0
+
     # socket used to listen for new clients
     _listen_socket = None
+    # selector watching the listen socket and every client socket for
+    # readability
+    _selector = None
+    # a connected pair of sockets used by other threads to wake 'update' up,
+    # and the callbacks they have left to be run
+    _wakeup_socket = None
+    _wakeup_send_socket = None
+    _callbacks = None
     # holds info on clients. Maps client id to _Client object
     _clients = {}
     # counter for assigning each client a new id
@@ -114,16 +199,58 @@ class MudServer(object):
     _events = []
     # list of newly-added occurences
     _new_events = []
-
-    def __init__(self):
+    # heap of (due time, sequence number, Timer) for pending timers
+    _timers = []
+    # counter used to keep timers due at the same moment in the order they
+    # were added
+    _timer_seq = 0
+    # whether output is held until the end of the tick rather than written
+    # straight away
+    _coalesce_output = False
+    # ids of clients with output held for the end of the tick
+    _pending_flush = set()
+    # whether dead clients are detected by the kernel's TCP keepalive rather
+    # than by sending them probe bytes
+    _tcp_keepalive = False
+
+    def __init__(self, host="0.0.0.0", port=1234, backlog=128,
+                 accept_budget=64, high_water=64 * 1024, lag_timeout=30.0,
+                 coalesce_output=False, tcp_keepalive=False):
         """Constructs the MudServer object and starts listening for
-        new players.
+        new players on the given 'host' and 'port'.
+
+        'backlog' is how many connections the operating system will hold
+        waiting to be accepted, and 'accept_budget' is the most that will
+        be accepted in one call to 'update'.
+
+        Output for each player is queued and written as the socket
+        accepts it. A player whose queued output stays above
+        'high_water' bytes for more than 'lag_timeout' seconds is
+        disconnected.
+
+        If 'coalesce_output' is True, messages are not written as they
+        are sent but held until 'flush' or the next 'update', so that
+        everything a player is sent in one pass of the game loop goes out
+        in a single write.
+
+        Each player is checked every few seconds to see whether they are
+        still connected by sending them an invisible character. If
+        'tcp_keepalive' is True, the operating system's TCP keepalive is
+        used to detect dead connections instead.
         """
 
+        self._accept_budget = accept_budget
+        self._high_water = high_water
+        self._lag_timeout = lag_timeout
+        self._coalesce_output = coalesce_output
+        self._tcp_keepalive = tcp_keepalive
+        self._pending_flush = set()
         self._clients = {}
         self._nextid = 0
         self._events = []
         self._new_events = []
+        self._timers = []
+        self._timer_seq = 0
 
         # create a new tcp socket which will be used to listen for new clients
         self._listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -135,33 +262,101 @@ class MudServer(object):
 
         # bind the socket to an ip address and port. Port 23 is the standard
         # telnet port which telnet clients will use, however on some platforms
-        # this requires root permissions, so we use a higher arbitrary port
-        # number instead: 1234. Address 0.0.0.0 means that we will bind to all
-        # of the available network interfaces
-        self._listen_socket.bind(("0.0.0.0", 1234))
+        # this requires root permissions, so by default we use a higher
+        # arbitrary port number instead: 1234. The default address 0.0.0.0
+        # means that we will bind to all of the available network interfaces
+        self._listen_socket.bind((host, port))
 
         # set to non-blocking mode. This means that when we call 'accept', it
         # will return immediately without waiting for a connection
         self._listen_socket.setblocking(False)
 
-        # start listening for connections on the socket
-        self._listen_socket.listen(1)
+        # start listening for connections on the socket, allowing 'backlog'
+        # connections to queue up before new ones are refused
+        self._listen_socket.listen(backlog)
+
+        # a single selector (epoll on Linux) is kept for the lifetime of the
+        # server. The listen socket is registered with no data attached and
+        # each client socket is registered with its client id, so one call to
+        # 'select' tells us exactly which sockets need attention
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listen_socket, selectors.EVENT_READ,
+                                None)
+
+        # other threads wake the selector by writing a byte to one end of a
+        # socket pair while the selector watches the other end
+        self._callbacks = collections.deque()
+        self._wakeup_socket, self._wakeup_send_socket = socket.socketpair()
+        self._wakeup_socket.setblocking(False)
+        self._wakeup_send_socket.setblocking(False)
+        self._selector.register(self._wakeup_socket, selectors.EVENT_READ,
+                                self._WAKEUP)
 
     def togglecolor(self, cid):
-        self._clients[cid].color_enabled = not self._clients[cid].color_enabled
+        # the player may have disconnected since the game asked for this
+        if cid in self._clients:
+            self._clients[cid].color_enabled = not self._clients[cid].color_enabled
 
-    def update(self):
+    def update(self, timeout=0):
         """Checks for new players, disconnected players, and new
         messages sent from players. This method must be called before
         up-to-date info can be obtained from the 'get_new_players',
         'get_disconnected_players' and 'get_commands' methods.
         It should be called in a loop to keep the game running.
+
+        'timeout' is how many seconds to wait for a socket to become
+        readable. The default of 0 returns immediately, None waits for
+        input. Either way the wait never runs past the next due timer, so
+        passing None lets the game loop sleep until there is something to
+        do.
         """
 
+        # write out the output from the last pass of the game loop before
+        # waiting for anything new
+        self.flush()
+
+        # don't wait past the point where the next timer is due. Cancelled
+        # timers are left in the heap until they reach the top
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if self._timers:
+            until_timer = max(0.0, self._timers[0][0] - time.monotonic())
+            if timeout is None or until_timer < timeout:
+                timeout = until_timer
+
+        # make a single readiness call covering the listen socket and every
+        # client socket
+        ready = self._selector.select(timeout)
+
         # check for new stuff
-        self._check_for_new_connections()
-        self._check_for_disconnected()
-        self._check_for_messages()
+        new_connection = False
+        readable = []
+        writable = []
+        for key, mask in ready:
+            if key.data is None:
+                new_connection = True
+            elif key.data == self._WAKEUP:
+                self._drain_wakeup_socket()
+            else:
+                if mask & selectors.EVENT_READ:
+                    readable.append(key.data)
+                if mask & selectors.EVENT_WRITE:
+                    writable.append(key.data)
+
+        # push out queued data to clients whose sockets have room for it
+        for id in writable:
+            if id in self._clients:
+                self._flush(id)
+
+        if new_connection:
+            self._check_for_new_connections()
+        self._run_timers()
+        self._run_callbacks()
+        self._check_for_messages(readable)
+
+        # write out anything queued while handling the above, such as Telnet
+        # negotiation replies
+        self.flush()
 
         # move the new events into the main events list so that they can be
         # obtained with 'get_new_players', 'get_disconnected_players' and
@@ -169,6 +364,49 @@ class MudServer(object):
         self._events = list(self._new_events)
         self._new_events = []
 
+    def flush(self):
+        """Writes out any output being held for the end of the tick. Only
+        needed when the server was created with 'coalesce_output', and
+        'update' does this itself.
+        """
+        pending = self._pending_flush
+        self._pending_flush = set()
+        for clid in pending:
+            if clid in self._clients:
+                self._flush(clid)
+
+    def call_later(self, delay, callback, *args):
+        """Arranges for 'callback' to be called with 'args' from within
+        'update' once 'delay' seconds have passed. Returns a Timer which
+        can be used to cancel it.
+        """
+        timer = Timer(callback, args)
+        self._schedule(timer, time.monotonic() + delay)
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Arranges for 'callback' to be called with 'args' from within
+        'update' as soon as possible. Unlike the other methods this can be
+        called from any thread, and it wakes up an 'update' which is
+        waiting for input, so it can be used to hand the results of work
+        done in the background back to the game.
+        """
+        self._callbacks.append((callback, args))
+        try:
+            self._wakeup_send_socket.send(b"\x00")
+        # if the socket is full, 'update' has plenty of wakeups waiting
+        except BlockingIOError:
+            pass
+
+    def call_every(self, interval, callback, *args):
+        """Arranges for 'callback' to be called with 'args' from within
+        'update' every 'interval' seconds, e.g. for health regeneration or
+        autosaving. Returns a Timer which can be used to cancel it.
+        """
+        timer = Timer(callback, args, interval)
+        self._schedule(timer, time.monotonic() + interval)
+        return timer
+
     def get_new_players(self):
         """Returns a list containing info on any new players that have
         entered the game since the last call to 'update'. Each item in
@@ -224,27 +462,57 @@ class MudServer(object):
         # message on its own line
 
 
+        # the player may have been disconnected earlier in this update, e.g.
+        # for falling too far behind on their output
+        if to not in self._clients:
+            return
+
         if auth and not self._clients[to].authenticated:
             return
 
-        if color is None:
-            msg = multiple_replace(message, get_color_list(), self._clients[to].color_enabled)
-            if self._clients[to].color_enabled:
-                self._attempt_send(to, msg + get_color('reset') + lineend)
-            else:
-                self._attempt_send(to, msg + lineend)
-        else:
-            if self._clients[to].color_enabled:
-                self._attempt_send(to, get_color(color) + message + get_color('reset') + lineend)
-            else:
-                self._attempt_send(to, message + lineend)
+        self._queue_send(to, self._render_message(
+            message, color, self._clients[to].color_enabled, lineend))
+
+    def broadcast(self, client_ids, message, color=None, auth=True,
+                  lineend="\r\n", exclude=None):
+        """Sends the text in the 'message' parameter to every player
+        whose id number is in 'client_ids', except the one given in
+        'exclude'. The other parameters work as they do for
+        'send_message'. The message is only rendered and encoded once for
+        players with color on and once for those with it off, however
+        many players it goes to.
+        """
+        rendered = {}
+        for to in client_ids:
+            if to == exclude:
+                continue
+            cl = self._clients.get(to)
+            if cl is None or (auth and not cl.authenticated):
+                continue
+
+            data = rendered.get(cl.color_enabled)
+            if data is None:
+                data = self._render_message(message, color, cl.color_enabled,
+                                            lineend)
+                rendered[cl.color_enabled] = data
+            self._queue_send(to, data)
 
     def disconnect(self, me):
-        self._clients[me].socket.close()
+        """Disconnects the player with the id number given in the 'me'
+        parameter. Any output still queued for them is discarded.
+        """
+        # they may have already gone
+        if me not in self._clients:
+            return
+
+        client_socket = self._clients[me].socket
         self._handle_disconnect(me)
+        client_socket.close()
 
     def authenticate(self, me):
-        self._clients[me].authenticated = True
+        # the player may have disconnected while their password was checked
+        if me in self._clients:
+            self._clients[me].authenticated = True
 
     def shutdown(self):
         """Closes down the server, disconnecting all clients and
@@ -256,7 +524,10 @@ class MudServer(object):
             cl.socket.shutdown(socket.SHUT_RDWR)
             cl.socket.close()
         # stop listening for new clients
+        self._selector.close()
         self._listen_socket.close()
+        self._wakeup_socket.close()
+        self._wakeup_send_socket.close()
 
     def send_char_status(self, clid, hp):
         if self._clients[clid].GMCP_ENABLED:
@@ -265,8 +536,7 @@ class MudServer(object):
 
     def mxp_secure(self, clid, message, mxp_code="1"):
         bytes_to_send = bytearray("\x1b[{}z{}\x1b[3z\r\n".format(mxp_code, message), 'utf-8')
-        client_socket = self._clients[clid].socket
-        client_socket.sendall(bytes_to_send)
+        self._queue_send(clid, bytes_to_send)
 
     def gmcp_message(self, clid, message):
         array = [self._TN_INTERPRET_AS_COMMAND, self._TN_SUBNEGOTIATION_START, self._GMCP]
@@ -278,42 +548,136 @@ class MudServer(object):
 
         print("SENDING GMCP")
         print(byte_data)
-        client_socket = self._clients[clid].socket
-        client_socket.sendall(byte_data)
+        self._queue_send(clid, byte_data)
+
+    def _render_message(self, message, color, color_enabled, lineend):
+
+        # turn a message into the bytes to send to a client, with the color
+        # codes replaced or removed and the line ending added
+        if color is None:
+            msg = render_colors(message, color_enabled)
+            if color_enabled:
+                msg = msg + get_color('reset') + lineend
+            else:
+                msg = msg + lineend
+        else:
+            if color_enabled:
+                msg = get_color(color) + message + get_color('reset') + lineend
+            else:
+                msg = message + lineend
+        return msg.encode("latin1")
 
     def _attempt_send(self, clid, data):
-        try:
-            # look up the client in the client map and use 'sendall' to send
-            # the message string on the socket. 'sendall' ensures that all of
-            # the data is sent in one go
-            self._clients[clid].socket.sendall(bytearray(data, "latin1"))
-        # KeyError will be raised if there is no client with the given id in
-        # the map
-        except KeyError:
-            pass
-        # If there is a connection problem with the client (e.g. they have
-        # disconnected) a socket error will be raised
-        except socket.error:
-            self._handle_disconnect(clid)
+        # encode the message string and queue it for the client
+        self._queue_send(clid, bytearray(data, "latin1"))
 
-    def _check_for_new_connections(self):
+    def _queue_send(self, clid, data):
+
+        # there may be no client with the given id in the map, e.g. if they
+        # have just disconnected
+        cl = self._clients.get(clid)
+        if cl is None:
+            return
+
+        # add the data to the client's outbound buffer and write as much of
+        # it as the socket will take right now, or leave it for the end of
+        # the tick if output is being coalesced
+        cl.outbuf += data
+        if self._coalesce_output:
+            self._pending_flush.add(clid)
+        else:
+            self._flush(clid)
 
-        # 'select' is used to check whether there is data waiting to be read
-        # from the socket. We pass in 3 lists of sockets, the first being those
-        # to check for readability. It returns 3 lists, the first being
-        # the sockets that are readable. The last parameter is how long to wait
-        # - we pass in 0 so that it returns immediately without waiting
-        rlist, wlist, xlist = select.select([self._listen_socket], [], [], 0)
-
-        # if the socket wasn't in the readable list, there's no data available,
-        # meaning no clients waiting to connect, and so we can exit the method
-        # here
-        if self._listen_socket not in rlist:
+    def _flush(self, clid):
+        cl = self._clients[clid]
+
+        if cl.outbuf:
+            try:
+                # 'send' writes as much as it can without blocking and tells
+                # us how much that was. Anything left over stays in the
+                # buffer until the socket is writable again
+                sent = cl.socket.send(cl.outbuf)
+            except BlockingIOError:
+                sent = 0
+            # If there is a connection problem with the client (e.g. they have
+            # disconnected) a socket error will be raised
+            except socket.error:
+                self.disconnect(clid)
+                return
+            del cl.outbuf[:sent]
+
+        # only ask the selector about writability while there is data
+        # waiting, otherwise it would report the socket on every update
+        if bool(cl.outbuf) != cl.want_write:
+            cl.want_write = bool(cl.outbuf)
+            events = selectors.EVENT_READ
+            if cl.want_write:
+                events |= selectors.EVENT_WRITE
+            self._selector.modify(cl.socket, events, clid)
+
+        self._check_backlog(clid)
+
+    def _pending_output(self, cl):
+        # how many bytes are waiting to be written to the client
+        return len(cl.outbuf)
+
+    def _check_backlog(self, clid):
+
+        # the client may already have gone by the time a recheck runs
+        cl = self._clients.get(clid)
+        if cl is None:
             return
 
-        # 'accept' returns a new socket and address info which can be used to
-        # communicate with the new client
-        joined_socket, addr = self._listen_socket.accept()
+        # a client can fall behind for a moment, but one that stays above the
+        # high-water mark is dropped so that its output doesn't pile up
+        # without limit. A stalled socket never becomes writable, so when a
+        # client first goes over the mark a timer is set to check it again
+        if self._pending_output(cl) <= self._high_water:
+            cl.lagging_since = None
+        elif cl.lagging_since is None:
+            cl.lagging_since = time.monotonic()
+            self.call_later(self._lag_timeout, self._check_backlog, clid)
+        elif time.monotonic() - cl.lagging_since >= self._lag_timeout:
+            self.disconnect(clid)
+
+    def _check_for_new_connections(self):
+
+        # accept every client waiting to connect, up to the per-update budget
+        # so that a flood of new connections can't hold up the players who
+        # are already in the game. Any left over are still waiting on the
+        # listen socket, so the selector will report it again next update
+        for i in range(self._accept_budget):
+            try:
+                # 'accept' returns a new socket and address info which can be
+                # used to communicate with the new client
+                joined_socket, addr = self._listen_socket.accept()
+
+            # there is nobody left waiting to connect
+            except BlockingIOError:
+                return
+
+            # the client gave up before we got to them
+            except ConnectionAbortedError:
+                continue
+
+            # something else went wrong, usually that the process or the
+            # system has run out of file descriptors (EMFILE or ENFILE). The
+            # client is left waiting, and the listen socket is ignored for a
+            # while, as it would otherwise wake every update for an accept
+            # that can only fail again
+            except OSError as e:
+                print("Couldn't accept a new connection: {}".format(e))
+                self._selector.unregister(self._listen_socket)
+                self.call_later(self._ACCEPT_PAUSE, self._resume_accepting)
+                return
+
+            self._add_client(joined_socket, addr)
+
+    def _resume_accepting(self):
+        self._selector.register(self._listen_socket, selectors.EVENT_READ,
+                                None)
+
+    def _add_client(self, joined_socket, addr):
 
         # set non-blocking mode on the new socket. This means that 'send' and
         # 'recv' will return immediately without waiting
@@ -322,13 +686,16 @@ class MudServer(object):
         # construct a new _Client object to hold info about the newly connected
         # client. Use 'nextid' as the new client's id number
         self._clients[self._nextid] = MudServer._Client(joined_socket, addr[0],
-                                                        "", time.time())
+                                                        b"", time.time())
+        # watch the new socket for incoming data, tagged with the client id
+        self._selector.register(joined_socket, selectors.EVENT_READ,
+                                self._nextid)
+        self._start_liveness_check(self._nextid)
         GMCP_REQUEST = bytearray([self._TN_INTERPRET_AS_COMMAND, self._TN_WILL, self._GMCP])
-        joined_socket.sendall(GMCP_REQUEST)
+        self._queue_send(self._nextid, GMCP_REQUEST)
 
         MXP_REQUEST = bytearray([self._TN_INTERPRET_AS_COMMAND, self._TN_WILL, self._MXP])
-        joined_socket.sendall(MXP_REQUEST)
-
+        self._queue_send(self._nextid, MXP_REQUEST)
 
         # add a new player occurence to the new events list with the player's
         # id number
@@ -338,71 +705,147 @@ class MudServer(object):
         # unique id number
         self._nextid += 1
 
-    def _check_for_disconnected(self):
+    def _schedule(self, timer, when):
+        heapq.heappush(self._timers, (when, self._timer_seq, timer))
+        self._timer_seq += 1
 
-        # go through all the clients
-        for id, cl in list(self._clients.items()):
+    def _run_timers(self):
 
-            # if we last checked the client less than 5 seconds ago, skip this
-            # client and move on to the next one
-            if time.time() - cl.lastcheck < 5.0:
+        # pop and run every timer that has come due. A callback may add new
+        # timers, but those are always due in the future
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            when, seq, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
                 continue
 
-            # send the client an invisible character. It doesn't actually
-            # matter what we send, we're really just checking that data can
-            # still be written to the socket. If it can't, an error will be
-            # raised and we'll know that the client has disconnected.
-            self._attempt_send(id, "\x00")
+            # put a repeating timer back before running it so that the
+            # callback is free to cancel it. If we have fallen behind, skip
+            # the missed runs rather than running it several times over
+            if timer.interval is not None:
+                self._schedule(timer, max(when + timer.interval, now))
+            timer.callback(*timer.args)
+
+    def _drain_wakeup_socket(self):
+        # the bytes themselves mean nothing, they only wake the selector
+        try:
+            while self._wakeup_socket.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _run_callbacks(self):
+        # only run the callbacks there are now, so that a callback which
+        # adds another can't keep us here forever
+        for i in range(len(self._callbacks)):
+            callback, args = self._callbacks.popleft()
+            callback(*args)
+
+    def _start_liveness_check(self, clid):
+        cl = self._clients[clid]
+
+        if self._tcp_keepalive:
+            # have the kernel probe the connection once it has been idle for
+            # the liveness interval. A dead connection then shows up as an
+            # error when reading from the socket. Not every platform lets us
+            # tune the timings, so only set the options that exist
+            cl.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            interval = max(1, int(self._LIVENESS_INTERVAL))
+            for name, value in (("TCP_KEEPIDLE", interval),
+                                ("TCP_KEEPINTVL", interval),
+                                ("TCP_KEEPCNT", self._KEEPALIVE_PROBES)):
+                if hasattr(socket, name):
+                    cl.socket.setsockopt(socket.IPPROTO_TCP,
+                                         getattr(socket, name), value)
+        else:
+            cl.liveness = self.call_every(self._LIVENESS_INTERVAL,
+                                          self._check_for_disconnected, clid)
+
+    def _check_for_disconnected(self, clid):
 
-            # update the last check time
-            cl.lastcheck = time.time()
+        # send the client an invisible character. It doesn't actually matter
+        # what we send, we're really just checking that data can still be
+        # written to the socket. If it can't, an error will be raised and
+        # we'll know that the client has disconnected.
+        self._attempt_send(clid, "\x00")
 
-    def _check_for_messages(self):
+        # update the last check time
+        if clid in self._clients:
+            self._clients[clid].lastcheck = time.time()
 
-        # go through all the clients
-        for id, cl in list(self._clients.items()):
+    def _check_for_messages(self, readable):
 
-            # we use 'select' to test whether there is data waiting to be read
-            # from the client socket. The function takes 3 lists of sockets,
-            # the first being those to test for readability. It returns 3 list
-            # of sockets, the first being those that are actually readable.
-            rlist, wlist, xlist = select.select([cl.socket], [], [], 0)
+        # go through the clients the selector reported as readable
+        for id in readable:
 
-            # if the client socket wasn't in the readable list, there is no
-            # new data from the client - we can skip it and move on to the next
-            # one
-            if cl.socket not in rlist:
+            # the client may have been disconnected earlier in this update,
+            # e.g. by a failed liveness check
+            cl = self._clients.get(id)
+            if cl is None:
                 continue
 
             try:
                 # read data from the socket, using a max length of 4096
-                data = cl.socket.recv(4096).decode("latin1")
+                data = cl.socket.recv(4096)
 
-                # process the data, stripping out any special Telnet commands
-                message = self._process_sent_data(cl, data)
+                # a readable socket with no data means the client has closed
+                # the connection
+                if not data:
+                    self._handle_disconnect(id)
+                    cl.socket.close()
+                    continue
 
-                # if there was a message in the data
-                if message:
-                    # remove any spaces, tabs etc from the start and end of
-                    # the message
-                    message = message.strip()
+                # process the data, stripping out any special Telnet commands
+                # and splitting it into complete lines
+                messages = self._process_sent_data(cl, data)
 
-                    # separate the message into the command (the first word)
-                    # and its parameters (the rest of the message)
-                    command, params = (message.split(" ", 1) + ["", ""])[:2]
+                # send any replies the Telnet negotiation queued up
+                if cl.outbuf:
+                    self._flush(id)
+                    if id not in self._clients:
+                        continue
 
-                    # add a command occurence to the new events list with the
-                    # player's id number, the command and its parameters
-                    self._new_events.append((self._EVENT_COMMAND, id,
-                                             command.lower(), params))
+                # each complete line is a separate command
+                for message in messages:
+                    self._add_command(id, message)
 
             # if there is a problem reading from the socket (e.g. the client
             # has disconnected) a socket error will be raised
             except socket.error:
-                self._handle_disconnect(id)
+                if id in self._clients:
+                    self._handle_disconnect(id)
+                cl.socket.close()
+
+    def _add_command(self, clid, message):
+
+        # ignore empty lines
+        if not message:
+            return
+
+        # remove any spaces, tabs etc from the start and end of the message
+        message = message.strip()
+
+        # separate the message into the command (the first word) and its
+        # parameters (the rest of the message)
+        command, params = (message.split(" ", 1) + ["", ""])[:2]
+
+        # add a command occurence to the new events list with the player's id
+        # number, the command and its parameters
+        self._new_events.append((self._EVENT_COMMAND, clid, command.lower(),
+                                 params))
 
     def _handle_disconnect(self, clid):
 
+        # stop checking whether the client is still connected
+        if self._clients[clid].liveness is not None:
+            self._clients[clid].liveness.cancel()
+
+        # stop watching the client's socket
+        try:
+            self._selector.unregister(self._clients[clid].socket)
+        except (KeyError, ValueError):
+            pass
+
         # remove the client from the clients map
         del (self._clients[clid])
 
@@ -411,7 +854,6 @@ class MudServer(object):
         self._new_events.append((self._EVENT_PLAYER_LEFT, clid))
 
     def _process_sent_data(self, client, data):
-        option_support = 0
         # the Telnet protocol allows special command codes to be inserted into
         # messages. For our very simple server we don't need to response to
         # any of these codes, but we must at least detect and skip over them
@@ -419,83 +861,97 @@ class MudServer(object):
         # More info on the Telnet protocol can be found here:
         # http://pcmicro.com/netfoss/telnet.html
 
-        # start with no message and in the normal state
-        message = None
-        state = self._READ_STATE_NORMAL
+        # 'data' is the raw bytes received. A command code or a line can be
+        # split across two reads, so the parser state and the partly received
+        # line are kept in the client between calls. Every complete line is
+        # returned, decoded to a string, in the order it was received
+        messages = []
+        state = client.read_state
+        pos = 0
+        end = len(data)
+
+        # position of the next 'interpret as command' code in the data, or
+        # the end of the data if there isn't one. Only searched for again
+        # once we've gone past it
+        iac = -1
 
-        # go through the data a character at a time
-        for c in data:
+        while pos < end:
 
-            # handle the character differently depending on the state we're in:
+            # handle the data differently depending on the state we're in:
 
             # normal state
             if state == self._READ_STATE_NORMAL:
 
+                # find the next byte that isn't plain text: either the special
+                # 'interpret as command' code or a newline, which ends the
+                # message. Everything before it can be added to the buffer in
+                # one go
+                if iac < pos:
+                    iac = data.find(b"\xff", pos)
+                    if iac == -1:
+                        iac = end
+                nl = data.find(b"\n", pos, iac)
+                stop = iac if nl == -1 else nl
+                self._append_text(client.buffer, data[pos:stop])
+                pos = stop + 1
+
+                if stop == end:
+                    break
+
                 # if we received the special 'interpret as command' code,
-                # switch to 'command' state so that we handle the next
-                # character as a command code and not as regular text data
-                if ord(c) == self._TN_INTERPRET_AS_COMMAND:
+                # switch to 'command' state so that we handle the next byte
+                # as a command code and not as regular text data
+                if stop == iac:
                     state = self._READ_STATE_COMMAND
 
-                # if we get a newline character, this is the end of the
-                # message. Set 'message' to the contents of the buffer and
-                # clear the buffer
-                elif c == "\n":
-                    message = client.buffer
-                    client.buffer = ""
-
-                # some telnet clients send the characters as soon as the user
-                # types them. So if we get a backspace character, this is where
-                # the user has deleted a character and we should delete the
-                # last character from the buffer.
-                elif c == "\x08":
-                    client.buffer = client.buffer[:-1]
-
-                # otherwise it's just a regular character - add it to the
-                # buffer where we're building up the received message
+                # otherwise we got a newline, so this is the end of a message.
+                # Add the contents of the buffer to the list and clear it
                 else:
-                    client.buffer += c
+                    messages.append(client.buffer.decode("latin1"))
+                    client.buffer = bytearray()
 
             # command state
             elif state == self._READ_STATE_COMMAND:
+                c = data[pos]
+                pos += 1
 
                 # the special 'start of subnegotiation' command code indicates
-                # that the following characters are a list of options until
-                # we're told otherwise. We switch into 'subnegotiation' state
-                # to handle this
-                if ord(c) == self._TN_SUBNEGOTIATION_START:
+                # that the following bytes are a list of options until we're
+                # told otherwise. We switch into 'subnegotiation' state to
+                # handle this
+                if c == self._TN_SUBNEGOTIATION_START:
                     state = self._READ_STATE_SUBNEG
 
                 # if the command code is one of the 'will', 'wont', 'do' or
-                # 'dont' commands, the following character will be an option
-                # code so we must remain in the 'command' state
-                elif ord(c) in (self._TN_WILL, self._TN_WONT, self._TN_DO,
-                                self._TN_DONT):
-                    option_support = ord(c)
+                # 'dont' commands, the following byte will be an option code
+                # so we must remain in the 'command' state
+                elif c in (self._TN_WILL, self._TN_WONT, self._TN_DO,
+                           self._TN_DONT):
+                    client.option_support = c
                     state = self._READ_STATE_COMMAND
 
                 # for all other command codes, there is no accompanying data so
                 # we can return to 'normal' state.
-                elif ord(c) == self._MXP:
-                    if option_support == self._TN_DO:
+                elif c == self._MXP:
+                    if client.option_support == self._TN_DO:
                         print("MXP Enabled")
                         client.MXP_ENABLED = True
                         # Enable for mushclient "on command"
                         byte_data = bytearray([self._TN_INTERPRET_AS_COMMAND, self._TN_SUBNEGOTIATION_START, self._MXP,
                                                self._TN_INTERPRET_AS_COMMAND, self._TN_SUBNEGOTIATION_END])
-                        client.socket.sendall(byte_data)
+                        client.outbuf += byte_data
                     else:
                         print("MXP Disabled")
                         client.MXP_ENABLED = False
                     state = self._READ_STATE_NORMAL
-                elif ord(c) == self._GMCP:
-                    if option_support == self._TN_DO:
+                elif c == self._GMCP:
+                    if client.option_support == self._TN_DO:
                         print("GMCP Enabled")
                         client.GMCP_ENABLED = True
                         # Enable for mushclient "on command"
                         byte_data = bytearray([self._TN_INTERPRET_AS_COMMAND, self._TN_SUBNEGOTIATION_START, self._GMCP,
                                                self._TN_INTERPRET_AS_COMMAND, self._TN_SUBNEGOTIATION_END])
-                        client.socket.sendall(byte_data)
+                        client.outbuf += byte_data
                     else:
                         print("GMCP Disabled")
                         client.GMCP_ENABLED = False
@@ -508,9 +964,34 @@ class MudServer(object):
 
                 # if we reach an 'end of subnegotiation' command, this ends the
                 # list of options and we can return to 'normal' state.
-                # Otherwise we must remain in this state
-                if ord(c) == self._TN_SUBNEGOTIATION_END:
+                # Otherwise we must remain in this state, skipping the rest of
+                # the data
+                se = data.find(b"\xf0", pos)
+                if se == -1:
+                    pos = end
+                else:
+                    pos = se + 1
                     state = self._READ_STATE_NORMAL
 
-        # return the contents of 'message' which is either a string or None
-        return message
+        # remember where we got to for the next piece of data
+        client.read_state = state
+
+        return messages
+
+    def _append_text(self, buffer, text):
+
+        # some telnet clients send the characters as soon as the user types
+        # them. So if we get a backspace character, this is where the user
+        # has deleted a character and we should delete the last character
+        # from the buffer.
+        if b"\x08" in text:
+            parts = text.split(b"\x08")
+            buffer += parts[0]
+            for part in parts[1:]:
+                del buffer[-1:]
+                buffer += part
+
+        # otherwise it's just regular text - add it to the buffer where we're
+        # building up the received message
+        else:
+            buffer += text
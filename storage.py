@@ -0,0 +1,825 @@
+"""Database access for starliner.py.
+
+Contains ConnectionPool, which keeps a small number of MySQL
+connections open and hands them out to the game's persistence
+functions so that each query doesn't pay for a new connection,
+SQLitePool, which does the same for an SQLite database file, Storage,
+which builds the pool from the server's Config and can rebuild it when
+the configuration is reloaded, SQLiteStorage, its counterpart for
+SQLite, ItemCache, which keeps item definitions in memory, and
+WriteBehind, which takes routine player state changes off the game loop
+and writes them in batches. Use open_storage to get whichever storage
+the configuration asks for.
+"""
+
+import collections
+import contextlib
+import functools
+import queue
+import sqlite3
+import threading
+import time
+
+# MySQL is only needed when it is the configured database
+try:
+    import mysql.connector
+except ImportError:
+    mysql = None
+
+from models import ItemDef
+
+
+# the columns of the itemdef table, in the order item_from_row expects them
+ITEM_COLUMNS = ('id', 'name', 'description', 'invulnerable', 'isuniq', 'isarmor', 'isweapon', 'power',
+                'basevalue', 'bound')
+
+
+def item_from_row(row):
+    """Turns a row of ITEM_COLUMNS from the itemdef table into an ItemDef."""
+    return ItemDef(row[0], row[1], row[2].replace('\n', '\n\r'), row[3], row[4], row[5], row[6], row[7], row[8],
+                   row[9])
+
+
+class ConnectionPool(object):
+    """A bounded pool of MySQL connections.
+
+    Connections are opened when first needed, up to 'size' of them, and
+    reused after that. A connection which has been sitting idle for more
+    than 'idle_check' seconds is pinged before being handed out, and
+    reconnected if the server has dropped it. A connection which fails
+    while in use is thrown away and replaced next time one is needed.
+    If it was one handed out before, the server may simply have dropped
+    it in the meantime, so the error is marked with 'dropped_connection'
+    for the storage layer to try again; see _reconnecting.
+
+    Connections are in autocommit mode, so each statement is committed as
+    it runs and a reused connection never sees an old snapshot of the
+    data.
+    """
+
+    def __init__(self, size=5, idle_check=30.0, timeout=10.0,
+                 **connect_args):
+        """Constructs the pool. 'connect_args' are passed on to
+        mysql.connector.connect. 'timeout' is how many seconds to wait
+        for a connection when all of them are in use.
+        """
+        if mysql is None:
+            raise RuntimeError("mysql.connector must be installed to use a MySQL database")
+
+        self._connect_args = dict(connect_args)
+        self._connect_args.setdefault("autocommit", True)
+        # fetch whole results up front, so that a query whose rows weren't
+        # all read can't leave the connection unusable for the next user
+        self._connect_args.setdefault("buffered", True)
+        self._idle_check = idle_check
+        self._timeout = timeout
+        self._closed = False
+
+        # the most recently used connection is handed out first. Each entry
+        # is a (connection, time last used) pair, or None for a connection
+        # that hasn't been opened yet
+        self._idle = queue.LifoQueue(maxsize=size)
+        for i in range(size):
+            self._idle.put(None)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Returns a context manager giving a connection from the pool,
+        which is returned to the pool at the end of the 'with' block:
+
+            with pool.connection() as mydb:
+                mycursor = mydb.cursor()
+                ...
+        """
+        try:
+            entry = self._idle.get(timeout=self._timeout)
+        except queue.Empty:
+            raise mysql.connector.errors.PoolError(
+                "No database connection became free within {} seconds".format(
+                    self._timeout))
+
+        conn = None
+        try:
+            conn = self._checkout(entry)
+            yield conn
+        except mysql.connector.errors.Error as e:
+            # a connection level problem means the connection can't be
+            # trusted any more, so close it rather than put it back
+            if conn is not None and isinstance(
+                    e, (mysql.connector.errors.OperationalError,
+                        mysql.connector.errors.InterfaceError)):
+                self._discard(conn)
+                conn = None
+                e.dropped_connection = entry is not None
+            raise
+        finally:
+            # a connection handed back after the pool was closed, e.g. by a
+            # configuration reload, is closed instead of kept
+            if conn is not None and self._closed:
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                self._idle.put(None)
+            else:
+                self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        """Closes every idle connection, and any in use as they are
+        returned. Call this when shutting down.
+        """
+        self._closed = True
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if entry is not None:
+                self._discard(entry[0])
+
+    def _checkout(self, entry):
+        if entry is None:
+            return mysql.connector.connect(**self._connect_args)
+
+        conn, last_used = entry
+        if time.monotonic() - last_used > self._idle_check:
+            # the server may have closed a connection that has been idle for
+            # a while, so check it and reconnect if need be. This is on the
+            # game loop, so there is one attempt and no waiting between
+            # attempts
+            try:
+                conn.ping(reconnect=True, attempts=1, delay=0)
+            except mysql.connector.errors.Error:
+                self._discard(conn)
+                raise
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except mysql.connector.errors.Error:
+            pass
+
+
+def _reconnecting(method):
+    # for methods which do all of their work with one connection from the
+    # storage layer. If that connection turns out to have been dropped by
+    # the database server since it was last used, the method is run again,
+    # once, with a new one. Such methods only read, or make their changes
+    # in a single statement or a transaction, so none of their changes have
+    # been made when the connection fails
+    @functools.wraps(method)
+    def wrapper(*args):
+        try:
+            return method(*args)
+        except Exception as e:
+            if not getattr(e, 'dropped_connection', False):
+                raise
+        return method(*args)
+    return wrapper
+
+
+@functools.lru_cache(maxsize=None)
+def _sqlite_query(query):
+    # the game's queries are written with MySQL's %s placeholders, and
+    # SQLite wants ?
+    return query.replace("%s", "?")
+
+
+class _SQLiteCursor(object):
+    """Gives an sqlite3 cursor the parameter style of mysql.connector"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query, params=()):
+        self._cursor.execute(_sqlite_query(query), params)
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(_sqlite_query(query), seq_of_params)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+
+class _SQLiteConnection(object):
+    """Gives an sqlite3 connection the part of the mysql.connector
+    interface that the game uses"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return _SQLiteCursor(self._conn.cursor())
+
+    def start_transaction(self):
+        # the write lock is taken straight away. A transaction which read
+        # first and then tried to write would fail at once, without waiting
+        # out the busy timeout, if another connection had written in between
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def executescript(self, script):
+        self._conn.executescript(script)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class SQLitePool(object):
+    """Connections to an SQLite database file, one for each thread that
+    uses it.
+
+    Used in place of a ConnectionPool when the game's database is an
+    SQLite file on the same machine. The database is put in write-ahead
+    log mode, so the game reading from it isn't held up by the
+    write-behind thread writing to it. As with ConnectionPool,
+    connections are in autocommit mode unless a transaction is started.
+    Each connection keeps the statements it has run compiled, so a query
+    the game runs often is only prepared once.
+    """
+
+    def __init__(self, path, timeout=10.0, cached_statements=256):
+        """Constructs the pool for the database at 'path'. 'timeout' is
+        how many seconds to wait for another connection's write to
+        finish.
+        """
+        self._path = path
+        self._timeout = timeout
+        self._cached_statements = cached_statements
+        self._local = threading.local()
+        # maps every open connection to how many 'with' blocks are using it
+        self._users = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Returns a context manager giving this thread's connection, in
+        the same way as ConnectionPool.connection.
+        """
+        with self._lock:
+            conn = getattr(self._local, 'conn', None)
+            if conn is None or conn not in self._users:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("The connection pool has been closed")
+                conn = None
+            else:
+                self._users[conn] += 1
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                self._users[conn] -= 1
+                # a connection handed back after the pool was closed, e.g. by
+                # a configuration reload, is closed instead of kept
+                if self._closed and self._users[conn] == 0:
+                    del self._users[conn]
+                    conn.close()
+
+    def close(self):
+        """Closes every idle connection, and any in use as they are
+        returned. Call this when shutting down.
+        """
+        with self._lock:
+            self._closed = True
+            for conn, users in list(self._users.items()):
+                if users == 0:
+                    del self._users[conn]
+                    conn.close()
+
+    def _connect(self):
+        raw = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None,
+                              check_same_thread=False, cached_statements=self._cached_statements)
+        raw.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode this is still safe against corruption, and only syncs
+        # the disk at checkpoints rather than on every commit
+        raw.execute("PRAGMA synchronous=NORMAL")
+        conn = _SQLiteConnection(raw)
+        with self._lock:
+            if self._closed:
+                conn.close()
+                raise sqlite3.ProgrammingError("The connection pool has been closed")
+            self._users[conn] = 1
+        return conn
+
+
+class ItemCache(object):
+    """Item definitions from the itemdef table, kept in memory.
+
+    Definitions are read-only ItemDefs shared by everything that refers
+    to the same item, so a player carrying ten of something holds ten
+    references to one definition rather than ten copies. Either call
+    'preload' to read every definition at startup, or let them be read
+    as they are first needed. If 'size' is given, only that many are
+    kept, dropping the least recently used. Call 'invalidate' after
+    changing itemdef so that the new definitions are read.
+    """
+
+    def __init__(self, storage, size=None):
+        self._storage = storage
+        self._size = size
+        self._items = collections.OrderedDict()
+
+    @_reconnecting
+    def get(self, itemid):
+        """Returns the definition of the item with id 'itemid'."""
+        item = self._items.get(itemid)
+        if item is not None:
+            self._items.move_to_end(itemid)
+            return item
+
+        with self._storage.connection() as mydb:
+            mycursor = mydb.cursor()
+            mycursor.execute("SELECT " + ", ".join(ITEM_COLUMNS) + " FROM itemdef WHERE id = %s", (itemid,))
+            row = mycursor.fetchone()
+        return self.from_row(row)
+
+    def from_row(self, row):
+        """Returns the definition for a row of ITEM_COLUMNS read from the
+        database, reusing the cached one if there is one.
+        """
+        item = self._items.get(row[0])
+        if item is not None:
+            self._items.move_to_end(row[0])
+            return item
+
+        item = item_from_row(row)
+        self._items[row[0]] = item
+        if self._size is not None and len(self._items) > self._size:
+            self._items.popitem(last=False)
+        return item
+
+    @_reconnecting
+    def preload(self):
+        """Reads every item definition in a single query."""
+        with self._storage.connection() as mydb:
+            mycursor = mydb.cursor()
+            mycursor.execute("SELECT " + ", ".join(ITEM_COLUMNS) + " FROM itemdef")
+            for row in mycursor.fetchall():
+                self.from_row(row)
+
+    def invalidate(self, itemid=None):
+        """Forgets the definition of the item with id 'itemid', or of
+        every item if no id is given. Items already in players'
+        inventories keep the old definition.
+        """
+        if itemid is None:
+            self._items.clear()
+        else:
+            self._items.pop(itemid, None)
+
+
+class Storage(object):
+    """The game's storage layer, for a MySQL database.
+
+    Owns the connection pool, built from the database settings in a
+    Config object, and the item definition cache. Call 'reload' to read
+    the configuration again, replace the pool and clear the cache
+    without restarting the game.
+
+    Other databases are supported by subclasses, such as SQLiteStorage,
+    which override '_make_pool' to return an object with the same
+    'connection' and 'close' methods as ConnectionPool, and any query
+    the database writes differently.
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self._pool = self._make_pool()
+        self.items = ItemCache(self, config['item_cache_size'] or None)
+
+    def connection(self):
+        """Returns a context manager giving a pooled connection. See
+        ConnectionPool.connection.
+        """
+        return self._pool.connection()
+
+    def reload(self):
+        """Reads the configuration again and switches to a new connection
+        pool built from it. Connections from the old pool are closed once
+        they are no longer in use. Cached item definitions are forgotten,
+        so changes made to itemdef are picked up. If anything goes wrong,
+        the error is raised and the old configuration and pool are kept.
+        """
+        previous = self._config.snapshot()
+        self._config.reload()
+        try:
+            pool = self._make_pool()
+        except Exception:
+            self._config.restore(previous)
+            raise
+        old = self._pool
+        self._pool = pool
+        old.close()
+        self.items.invalidate()
+
+    def close(self):
+        """Closes the connection pool. Call this when shutting down."""
+        self._pool.close()
+
+    @_reconnecting
+    def load_player(self, name):
+        """Loads everything needed to log in the player called 'name'
+        using one connection and a fixed number of queries, however many
+        items they are carrying. Returns None if there is no such player,
+        otherwise a dictionary with the player's 'id', 'name', 'password'
+        hash and 'lastroom', their 'attribs' as a dictionary, their
+        'inventory' as a list of items, and 'items', a dictionary of
+        their equipped armor and weapon items by id. Items are shared
+        definitions from the item cache.
+        """
+        columns = ", ".join("itemdef." + c for c in ITEM_COLUMNS)
+
+        with self.connection() as mydb:
+            mycursor = mydb.cursor()
+            mycursor.execute("SELECT id, name, password, lastroom FROM players WHERE name = %s", (name,))
+            row = mycursor.fetchone()
+            if row is None:
+                return None
+            player = {'id': row[0], 'name': row[1], 'password': row[2], 'lastroom': row[3]}
+
+            # should an attribute have more than one row, the newest wins
+            mycursor.execute("SELECT attrib, value FROM playerattr WHERE pid = %s ORDER BY id", (player['id'],))
+            player['attribs'] = dict(mycursor.fetchall())
+
+            mycursor.execute("SELECT " + columns + " FROM inventory JOIN itemdef ON itemdef.id = inventory.itemid "
+                             "WHERE inventory.playerid = %s", (player['id'],))
+            player['inventory'] = [self.items.from_row(irow) for irow in mycursor.fetchall()]
+
+            equipped = set()
+            for attrib in ('armor', 'weapon'):
+                itemid = int(player['attribs'].get(attrib, 0))
+                if itemid != 0:
+                    equipped.add(itemid)
+            player['items'] = {}
+            if equipped:
+                mycursor.execute("SELECT " + columns + " FROM itemdef WHERE id IN ("
+                                 + ", ".join(["%s"] * len(equipped)) + ")", tuple(equipped))
+                for irow in mycursor.fetchall():
+                    player['items'][irow[0]] = self.items.from_row(irow)
+
+        return player
+
+    @_reconnecting
+    def name_taken(self, name):
+        """Returns True if there is already a player called 'name'."""
+        with self.connection() as mydb:
+            mycursor = mydb.cursor()
+            mycursor.execute("SELECT name FROM players WHERE name = %s", (name,))
+            return mycursor.fetchone() is not None
+
+    @_reconnecting
+    def create_player(self, name, hashed):
+        """Adds a new player called 'name' with the password hash
+        'hashed', starting in room 1. Returns their id.
+        """
+        with self.connection() as mydb:
+            mycursor = mydb.cursor()
+            mycursor.execute("INSERT INTO players (name, password, lastroom) VALUES(%s, %s, 1)", (name, hashed))
+            return mycursor.lastrowid
+
+    def unit_of_work(self):
+        """Returns a UnitOfWork for gathering changes to be written
+        together.
+        """
+        return UnitOfWork(self)
+
+    # the changes below which are made with a single statement, and so are
+    # atomic on their own
+    _single_statement = frozenset(('_add_inventory', '_remove_inventory'))
+
+    def _add_inventory(self, mycursor, pid, itemid):
+        mycursor.execute("INSERT INTO inventory (itemid, playerid) VALUES(%s, %s)", (itemid, pid))
+
+    def _remove_inventory(self, mycursor, pid, itemid):
+        mycursor.execute("DELETE FROM inventory WHERE itemid = %s AND playerid = %s LIMIT 1", (itemid, pid))
+
+    def _set_attrib(self, mycursor, pid, attrib, value):
+        # existing MySQL databases have no unique key on (pid, attrib) for an
+        # upsert to rely on, so look for the row first
+        mycursor.execute("SELECT id FROM playerattr WHERE pid = %s AND attrib = %s", (pid, attrib))
+        row = mycursor.fetchone()
+        if row is None:
+            mycursor.execute("INSERT INTO playerattr (pid, attrib, value) VALUES(%s, %s, %s)", (pid, attrib, value))
+        else:
+            mycursor.execute("UPDATE playerattr SET value = %s WHERE id = %s", (value, row[0]))
+
+    def _make_pool(self):
+        return ConnectionPool(
+            size=self._config['pool_size'],
+            host=self._config['host'],
+            user=self._config['username'],
+            password=self._config['password'],
+            database=self._config['database']
+        )
+
+
+class UnitOfWork(object):
+    """Changes to players' inventories and attributes which are written
+    together in a single transaction, so that either all of them are
+    saved or none are.
+
+    Changes are gathered by calling 'add_inventory', 'remove_inventory'
+    and 'set_attrib', and written by 'commit'. Used as a context manager,
+    the changes are committed at the end of the 'with' block unless it
+    raises an exception:
+
+        with storage.unit_of_work() as work:
+            work.remove_inventory(pid, itemid)
+            work.set_attrib(pid, "weapon", itemid)
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._changes = []
+
+    def add_inventory(self, pid, itemid):
+        """Puts one of item 'itemid' in the inventory of player 'pid'."""
+        self._changes.append((self._storage._add_inventory, pid, itemid))
+
+    def remove_inventory(self, pid, itemid):
+        """Takes one of item 'itemid' out of the inventory of player
+        'pid'.
+        """
+        self._changes.append((self._storage._remove_inventory, pid, itemid))
+
+    def set_attrib(self, pid, attrib, value):
+        """Sets one of player 'pid's attributes."""
+        self._changes.append((self._storage._set_attrib, pid, attrib, value))
+
+    def commit(self):
+        """Writes every change gathered so far using one connection and
+        one transaction.
+        """
+        changes = self._changes
+        self._changes = []
+        if changes:
+            self._write(changes)
+
+    @_reconnecting
+    def _write(self, changes):
+        with self._storage.connection() as mydb:
+            # connections are in autocommit mode, so one change made with a
+            # single statement is already atomic and doesn't need the extra
+            # round trips of a transaction
+            if len(changes) == 1 and changes[0][0].__name__ in self._storage._single_statement:
+                changes[0][0](mydb.cursor(), *changes[0][1:])
+                return
+
+            mydb.start_transaction()
+            try:
+                mycursor = mydb.cursor()
+                for change in changes:
+                    change[0](mycursor, *change[1:])
+                mydb.commit()
+            except Exception:
+                mydb.rollback()
+                raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._changes = []
+
+
+# the tables used by the game
+TABLES = ('players', 'playerattr', 'itemdef', 'inventory', 'roomdef', 'exitdef', 'objdef', 'roominv', 'npcdef',
+          'roomnpc')
+
+# the game's tables, for creating an empty SQLite database
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (id INTEGER PRIMARY KEY, name TEXT NOT NULL, password TEXT NOT NULL,
+                                    lastroom INTEGER NOT NULL DEFAULT 1);
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+CREATE TABLE IF NOT EXISTS playerattr (id INTEGER PRIMARY KEY, pid INTEGER NOT NULL, attrib TEXT NOT NULL,
+                                       value TEXT);
+CREATE UNIQUE INDEX IF NOT EXISTS playerattr_pid_attrib ON playerattr (pid, attrib);
+CREATE TABLE IF NOT EXISTS itemdef (id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT NOT NULL,
+                                    invulnerable INTEGER NOT NULL DEFAULT 0, isuniq INTEGER NOT NULL DEFAULT 0,
+                                    isarmor INTEGER NOT NULL DEFAULT 0, isweapon INTEGER NOT NULL DEFAULT 0,
+                                    power INTEGER NOT NULL DEFAULT 0, basevalue INTEGER NOT NULL DEFAULT 0,
+                                    bound INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS inventory (id INTEGER PRIMARY KEY, itemid INTEGER NOT NULL, playerid INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS inventory_playerid ON inventory (playerid);
+CREATE TABLE IF NOT EXISTS roomdef (id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS exitdef (id INTEGER PRIMARY KEY, fromroom INTEGER NOT NULL, name TEXT NOT NULL,
+                                    toroom INTEGER NOT NULL, itemkey INTEGER NOT NULL DEFAULT 0, failkey TEXT);
+CREATE TABLE IF NOT EXISTS objdef (id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT NOT NULL,
+                                   movable INTEGER NOT NULL DEFAULT 0, failtake TEXT, takesuccess TEXT,
+                                   takeitem INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS roominv (id INTEGER PRIMARY KEY, roomid INTEGER NOT NULL, objid INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS npcdef (id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT NOT NULL,
+                                   code INTEGER NOT NULL DEFAULT 0, arg TEXT);
+CREATE TABLE IF NOT EXISTS roomnpc (id INTEGER PRIMARY KEY, roomid INTEGER NOT NULL, npcid INTEGER NOT NULL);
+"""
+
+
+class SQLiteStorage(Storage):
+    """The game's storage layer, for an SQLite database file.
+
+    Works as Storage does, but keeps everything in the file named by the
+    'sqlite_path' setting, so that no separate database server is
+    needed. The game's tables are created in the file if they aren't
+    there already.
+    """
+
+    def __init__(self, config):
+        Storage.__init__(self, config)
+        with self.connection() as mydb:
+            mydb.executescript(SQLITE_SCHEMA)
+
+    # the schema has a unique index on (pid, attrib), so attributes are set
+    # with a single upsert
+    _single_statement = Storage._single_statement | {'_set_attrib'}
+
+    def _set_attrib(self, mycursor, pid, attrib, value):
+        mycursor.execute("INSERT INTO playerattr (pid, attrib, value) VALUES(%s, %s, %s) "
+                         "ON CONFLICT (pid, attrib) DO UPDATE SET value = excluded.value", (pid, attrib, value))
+
+    def _remove_inventory(self, mycursor, pid, itemid):
+        # SQLite doesn't allow LIMIT on a DELETE
+        mycursor.execute("DELETE FROM inventory WHERE id = (SELECT id FROM inventory WHERE itemid = %s "
+                         "AND playerid = %s LIMIT 1)", (itemid, pid))
+
+    def _make_pool(self):
+        return SQLitePool(self._config['sqlite_path'])
+
+
+def open_storage(config):
+    """Returns the storage layer for the database named by the 'database_type'
+    setting, either 'mysql' or 'sqlite'.
+    """
+    if config['database_type'] == 'sqlite':
+        return SQLiteStorage(config)
+    if config['database_type'] == 'mysql':
+        return Storage(config)
+    raise ValueError("Unknown database_type '{}'".format(config['database_type']))
+
+
+class WriteBehind(object):
+    """Queues routine player state changes and writes them to the
+    database from a background thread.
+
+    Changes are recorded against a key, so repeated changes to the same
+    thing (e.g. a player walking through ten rooms) only leave the
+    latest value to be written. A worker thread writes everything
+    outstanding in a single transaction every 'interval' seconds, or
+    sooner if more than 'max_pending' changes build up or 'flush' is
+    called. While the database is working, a crash loses at most the
+    changes made since the last write, a little over 'interval' seconds'
+    worth.
+
+    A batch which fails to write is kept and tried again with the next
+    one, so nothing is dropped while the database is unavailable, but
+    nothing is safe from a crash either until it comes back. The backlog
+    can't grow without limit, as it holds only the latest value for each
+    player's room and attributes.
+    """
+
+    def __init__(self, storage, interval=1.0, max_pending=500):
+        self._storage = storage
+        self._interval = interval
+        self._max_pending = max_pending
+
+        # changes waiting to be written, and those being written right now.
+        # Maps key to value, where the key is ('room', player id) or
+        # ('attrib', player id, attribute name)
+        self._dirty = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # notified whenever a batch has been written, or has failed to be
+        self._written = threading.Condition(self._lock)
+        # how many batches have failed to write so far
+        self._failures = 0
+        # set to make the worker write straight away
+        self._wake = threading.Event()
+        self._closing = False
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def set_room(self, pid, room):
+        """Records that the player with database id 'pid' is now in
+        'room'.
+        """
+        self._set(('room', pid), room)
+
+    def set_attrib(self, pid, attrib, value):
+        """Records a new value for one of the player's attributes."""
+        self._set(('attrib', pid, attrib), value)
+
+    def pending(self, key, default=None):
+        """Returns the value waiting to be written for 'key', or 'default'
+        if there isn't one. Used when reading a player back from the
+        database so that changes not yet written aren't missed.
+        """
+        with self._lock:
+            if key in self._dirty:
+                return self._dirty[key]
+            return self._inflight.get(key, default)
+
+    def flush(self, wait=False):
+        """Asks the worker to write everything outstanding now, e.g. when
+        a player logs out. If 'wait' is True, blocks until it has been
+        written, or until a write fails, and returns whether everything
+        was written.
+        """
+        with self._lock:
+            self._wake.set()
+            if not wait:
+                return None
+            failures = self._failures
+            while (self._dirty or self._inflight) and self._failures == failures and \
+                    self._thread.is_alive():
+                self._written.wait(self._interval)
+            return not (self._dirty or self._inflight)
+
+    def close(self):
+        """Writes everything outstanding and stops the worker. Call this
+        when shutting down.
+        """
+        self._closing = True
+        self._wake.set()
+        self._thread.join()
+
+    def _set(self, key, value):
+        with self._lock:
+            self._dirty[key] = value
+            if len(self._dirty) >= self._max_pending:
+                self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            closing = self._closing
+
+            with self._lock:
+                self._inflight = self._dirty
+                self._dirty = {}
+            if self._inflight:
+                self._write()
+
+            if closing:
+                return
+
+    def _write(self):
+        batch = self._inflight
+        try:
+            with self._storage.connection() as mydb:
+                mydb.start_transaction()
+                try:
+                    self._write_batch(mydb, batch)
+                    mydb.commit()
+                except Exception:
+                    mydb.rollback()
+                    raise
+            written = True
+        except Exception as e:
+            print("Failed to write {} player changes: {}".format(len(batch), e))
+            written = False
+
+        with self._lock:
+            # if the write failed, keep the changes for the next attempt
+            # unless they have been superseded in the meantime
+            if not written:
+                self._failures += 1
+                for key, value in batch.items():
+                    self._dirty.setdefault(key, value)
+            self._inflight = {}
+            self._written.notify_all()
+
+    def _write_batch(self, mydb, batch):
+        mycursor = mydb.cursor()
+        for key, value in batch.items():
+            if key[0] == 'room':
+                mycursor.execute("UPDATE players SET lastroom = %s WHERE id = %s", (value, key[1]))
+            else:
+                self._storage._set_attrib(mycursor, key[1], key[2], value)
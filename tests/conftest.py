@@ -0,0 +1,20 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from config import Config
+from storage import open_storage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """An SQLite-backed Storage in a fresh database file."""
+    path = tmp_path / "db.json"
+    path.write_text(json.dumps({'database_type': 'sqlite', 'sqlite_path': str(tmp_path / "starliner.db")}))
+    db = open_storage(Config(str(path), environ={}))
+    yield db
+    db.close()
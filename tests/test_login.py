@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from engine import Engine
+from storage import WriteBehind
+from transports import FakeTransport
+from world import load_world
+
+bcrypt = pytest.importorskip("bcrypt")
+
+from auth import Authenticator
+
+
+@pytest.fixture
+def game(storage):
+    with storage.connection() as mydb:
+        mydb.cursor().execute("INSERT INTO roomdef (id, name, description) VALUES (1, 'Bridge', 'The bridge.')")
+
+    transport = FakeTransport()
+    auth = Authenticator(transport.call_soon_threadsafe, workers=1, rounds=4)
+    writes = WriteBehind(storage, interval=60)
+    engine = Engine(load_world(storage), storage, writes, auth)
+    yield engine, transport
+    writes.close()
+    auth.close()
+
+
+def run_until(engine, transport, condition, timeout=10.0):
+    # password checks finish in the background, so keep the game running
+    # until they have come back
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        engine.process(transport)
+        time.sleep(0.01)
+
+
+def log_in(engine, transport, *lines):
+    """Connects a player, has them type 'lines' and waits until they are
+    either in the game or disconnected. Returns their id."""
+    id = transport.connect()
+    engine.process(transport)
+    for line in lines:
+        transport.type(id, line)
+    run_until(engine, transport, lambda: id not in engine.players or not engine.players[id].authenticating and
+              engine.players[id].room is not None)
+    return id
+
+
+def welcomed(transport, id):
+    return any("Welcome" in message for message in transport.output[id])
+
+
+def test_a_new_player_can_log_back_in(game):
+    engine, transport = game
+
+    id = log_in(engine, transport, "new", "alice", "longpassword")
+    assert welcomed(transport, id)
+    transport.type(id, "quit")
+    run_until(engine, transport, lambda: id not in engine.players)
+
+    id = log_in(engine, transport, "alice", "longpassword")
+    assert welcomed(transport, id)
+    assert engine.players[id].name == "alice"
+
+
+def test_a_wrong_password_is_refused(game):
+    engine, transport = game
+
+    id = log_in(engine, transport, "new", "alice", "longpassword")
+    transport.type(id, "quit")
+    run_until(engine, transport, lambda: id not in engine.players)
+
+    id = log_in(engine, transport, "alice", "wrongpassword")
+    assert id not in engine.players
+    assert not welcomed(transport, id)
+
+
+def test_commands_typed_while_logging_in_run_afterwards(game):
+    engine, transport = game
+
+    id = log_in(engine, transport, "new", "alice", "longpassword", "say hello")
+    assert welcomed(transport, id)
+    assert any("alice says: hello" in message for message in transport.output[id])
+    assert engine.players[id].waiting == []
@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from storage import WriteBehind
+
+
+@pytest.fixture
+def player(storage):
+    storage.create_player('alice', 'hash')
+    return storage.load_player('alice')['id']
+
+
+class Batches(list):
+    """The batches WriteBehind has written. Exceptions put in 'failures'
+    are raised by the next writes instead."""
+
+    def __init__(self):
+        super().__init__()
+        self.failures = []
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    written = Batches()
+    write_batch = WriteBehind._write_batch
+
+    def record(self, mydb, batch):
+        if written.failures:
+            raise written.failures.pop()
+        written.append(dict(batch))
+        write_batch(self, mydb, batch)
+
+    monkeypatch.setattr(WriteBehind, '_write_batch', record)
+    return written
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_changes_to_the_same_thing_are_coalesced(storage, player, batches):
+    writes = WriteBehind(storage, interval=60)
+    try:
+        for room in range(1, 11):
+            writes.set_room(player, room)
+        writes.set_attrib(player, 'gold', '5')
+        writes.set_attrib(player, 'gold', '7')
+        assert writes.flush(wait=True)
+    finally:
+        writes.close()
+
+    assert batches == [{('room', player): 10, ('attrib', player, 'gold'): '7'}]
+    row = storage.load_player('alice')
+    assert row['lastroom'] == 10
+    assert row['attribs']['gold'] == '7'
+
+
+def test_pending_changes_are_visible_before_they_are_written(storage, player, batches):
+    writes = WriteBehind(storage, interval=60)
+    try:
+        writes.set_attrib(player, 'health', '42')
+        assert writes.pending(('attrib', player, 'health')) == '42'
+        assert writes.pending(('attrib', player, 'gold'), '0') == '0'
+        assert batches == []
+    finally:
+        writes.close()
+
+
+def test_max_pending_changes_are_written_early(storage, player, batches):
+    writes = WriteBehind(storage, interval=60, max_pending=3)
+    try:
+        writes.set_attrib(player, 'gold', '1')
+        writes.set_attrib(player, 'health', '2')
+        assert not wait_for(lambda: batches, timeout=0.2)
+        writes.set_attrib(player, 'color', 'False')
+        assert wait_for(lambda: batches)
+    finally:
+        writes.close()
+
+    assert len(batches[0]) == 3
+    assert storage.load_player('alice')['attribs'] == {'gold': '1', 'health': '2', 'color': 'False'}
+
+
+def test_a_failed_batch_is_retried(storage, player, batches, capsys):
+    batches.failures.append(RuntimeError("database is down"))
+    writes = WriteBehind(storage, interval=60)
+    try:
+        writes.set_attrib(player, 'gold', '5')
+        writes.set_room(player, 3)
+        assert not writes.flush(wait=True)
+        assert "database is down" in capsys.readouterr().out
+        assert writes.pending(('attrib', player, 'gold')) == '5'
+
+        # a change made while the batch was waiting to be retried wins
+        writes.set_attrib(player, 'gold', '9')
+        assert writes.flush(wait=True)
+    finally:
+        writes.close()
+
+    row = storage.load_player('alice')
+    assert row['lastroom'] == 3
+    assert row['attribs']['gold'] == '9'
+
+
+def test_everything_outstanding_is_written_on_close(storage, player, batches):
+    writes = WriteBehind(storage, interval=60)
+    writes.set_room(player, 4)
+    writes.set_attrib(player, 'gold', '12')
+    writes.close()
+
+    row = storage.load_player('alice')
+    assert row['lastroom'] == 4
+    assert row['attribs']['gold'] == '12'
@@ -0,0 +1,120 @@
+"""Transports connecting the game Engine to its players.
+
+Contains MudServerTransport, which connects an Engine to real players
+through a MudServer, and FakeTransport, which keeps everything in
+memory so that the game can be driven by tests and benchmarks without
+any sockets.
+
+A transport has three methods: 'poll', which returns the next batch of
+input events for Engine.process, 'send', which carries out a list of the
+Engine's output events, and 'call_soon_threadsafe', which runs a
+callback on the thread calling 'poll', as background work such as
+password checks needs.
+"""
+
+import collections
+
+from engine import Engine
+
+
+class MudServerTransport(object):
+    """Connects an Engine to players through 'mud', a MudServer."""
+
+    def __init__(self, mud):
+        self.mud = mud
+
+    def poll(self):
+        """Waits until something happens, then returns the input events."""
+        self.mud.update(timeout=None)
+
+        events = [(Engine.NEW_PLAYER, id) for id in self.mud.get_new_players()]
+        events.extend((Engine.PLAYER_LEFT, id) for id in self.mud.get_disconnected_players())
+        events.extend((Engine.COMMAND, id, command, params) for id, command, params in self.mud.get_commands())
+        return events
+
+    def send(self, events):
+        """Carries out the output events by calling the MudServer method
+        of the same name.
+        """
+        for event in events:
+            getattr(self.mud, event[0])(*event[1:])
+
+    def call_soon_threadsafe(self, callback, *args):
+        self.mud.call_soon_threadsafe(callback, *args)
+
+
+class FakeTransport(object):
+    """A transport with no network, for driving an Engine in-process.
+
+    Players are connected with 'connect', made to type with 'type' and
+    disconnected with 'close'. Everything sent to a player is kept, with
+    color codes left in, in 'output', a dictionary of lists of messages
+    by player id.
+    """
+
+    def __init__(self):
+        self.output = {}
+        self._connected = set()
+        self._nextid = 0
+        self._input = []
+        self._authenticated = set()
+        self._callbacks = collections.deque()
+
+    def connect(self):
+        """Connects a new player and returns their id number."""
+        id = self._nextid
+        self._nextid += 1
+        self.output[id] = []
+        self._connected.add(id)
+        self._input.append((Engine.NEW_PLAYER, id))
+        return id
+
+    def type(self, id, line):
+        """Has player 'id' type 'line', split into a command and its
+        parameters as MudServer does.
+        """
+        command, params = (line.strip().split(" ", 1) + ["", ""])[:2]
+        self._input.append((Engine.COMMAND, id, command.lower(), params))
+
+    def close(self, id):
+        """Disconnects player 'id', as if they had closed the connection."""
+        self.disconnect(id)
+
+    def poll(self):
+        # run any callbacks from background work first, as MudServer does
+        while self._callbacks:
+            callback, args = self._callbacks.popleft()
+            callback(*args)
+
+        events = self._input
+        self._input = []
+        return events
+
+    def send(self, events):
+        for event in events:
+            getattr(self, event[0])(*event[1:])
+
+    def call_soon_threadsafe(self, callback, *args):
+        self._callbacks.append((callback, args))
+
+    def send_message(self, to, message, color=None, auth=True, lineend="\r\n"):
+        if to in self._connected and (to in self._authenticated or not auth):
+            self.output[to].append(message)
+
+    def broadcast(self, client_ids, message, color=None, auth=True, lineend="\r\n", exclude=None):
+        for to in client_ids:
+            if to != exclude:
+                self.send_message(to, message, color, auth, lineend)
+
+    def authenticate(self, id):
+        if id in self._connected:
+            self._authenticated.add(id)
+
+    def togglecolor(self, id):
+        pass
+
+    def disconnect(self, id):
+        if id in self._connected:
+            self._connected.discard(id)
+            self._authenticated.discard(id)
+            self._input.append((Engine.PLAYER_LEFT, id))
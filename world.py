@@ -0,0 +1,205 @@
+"""Loading the game world for starliner.py.
+
+Contains load_world, which reads every room along with its exits,
+objects and NPCs from the database in a handful of queries and puts
+them together in memory, save_snapshot and load_snapshot, which
+write the loaded world to a file and read it back far more quickly, and
+Occupancy, which keeps track of which players are in each room.
+
+A snapshot is built offline from the database with
+
+    python world.py [db.json] [snapshot file]
+
+and is used at startup when the 'world_snapshot' setting names it. The
+snapshot is not updated when the world tables change, so build it again
+after editing the world.
+"""
+
+import gc
+import hashlib
+import os
+import pickle
+import sys
+import time
+
+from models import NPC, Exit, Room, WorldObject
+
+# identifies snapshot files, followed by the snapshot version
+SNAPSHOT_MAGIC = b"STARWORLD"
+# change this whenever the layout of the loaded rooms changes, so that
+# old snapshots are ignored rather than loaded into the wrong shape
+SNAPSHOT_VERSION = 3
+
+
+def load_world(db):
+    """Reads the whole world using the storage layer 'db' and returns a
+    dictionary of rooms keyed by room id, in the order the database gave
+    them. Each room is a Room, holding lists of its Exits, WorldObjects
+    and NPCs. Prints how long loading took and how much was loaded.
+    """
+    start = time.perf_counter()
+
+    with db.connection() as mydb:
+        mycursor = mydb.cursor()
+        mycursor.execute("SELECT id, name, description FROM roomdef")
+        roomrows = mycursor.fetchall()
+        mycursor.execute("SELECT fromroom, id, name, toroom, itemkey, failkey FROM exitdef ORDER BY id")
+        exitrows = mycursor.fetchall()
+        mycursor.execute("SELECT roominv.roomid, roominv.objid, objdef.name, objdef.description, objdef.movable, "
+                         "objdef.failtake, objdef.takesuccess, objdef.takeitem "
+                         "FROM roominv JOIN objdef ON objdef.id = roominv.objid")
+        objrows = mycursor.fetchall()
+        mycursor.execute("SELECT roomnpc.roomid, roomnpc.npcid, npcdef.name, npcdef.description, npcdef.code, "
+                         "npcdef.arg FROM roomnpc JOIN npcdef ON npcdef.id = roomnpc.npcid")
+        npcrows = mycursor.fetchall()
+
+    byid = {}
+    for row in roomrows:
+        byid[row[0]] = Room(row[0], row[1], row[2].replace('\n', '\n\r'))
+
+    # exits, objects and NPCs belonging to rooms that don't exist are skipped
+    for exrow in exitrows:
+        if exrow[0] in byid:
+            byid[exrow[0]].exits.append(Exit(exrow[2], exrow[3], exrow[4], exrow[5]))
+
+    for objrow in objrows:
+        if objrow[0] in byid:
+            byid[objrow[0]].items.append(WorldObject(objrow[1], objrow[2], objrow[3].replace('\n', '\n\r'),
+                                                     objrow[4], objrow[5], objrow[6], objrow[7]))
+
+    for npcrow in npcrows:
+        if npcrow[0] in byid:
+            byid[npcrow[0]].npcs.append(NPC(npcrow[1], npcrow[2], npcrow[3].replace('\n', '\n\r'), npcrow[4],
+                                            npcrow[5]))
+
+    for room in byid.values():
+        room.index()
+
+    print("Loaded {} rooms, {} exits, {} objects and {} NPCs in {:.1f} ms".format(
+        len(roomrows), len(exitrows), len(objrows), len(npcrows), (time.perf_counter() - start) * 1000))
+
+    return byid
+
+
+class Occupancy(object):
+    """Keeps track of the players in each room, so that finding everyone
+    in a room doesn't mean looking at every player in the game.
+
+    Rooms are identified by id and players by their client id. Players
+    must be added when they enter the world, moved whenever their room
+    changes and removed when they leave.
+    """
+
+    _EMPTY = frozenset()
+
+    def __init__(self):
+        self._rooms = {}
+
+    def add(self, pid, room):
+        """Puts player 'pid' in 'room'."""
+        self._rooms.setdefault(room, set()).add(pid)
+
+    def remove(self, pid, room):
+        """Takes player 'pid' out of 'room'."""
+        occupants = self._rooms.get(room)
+        if occupants is not None:
+            occupants.discard(pid)
+            # forget empty rooms, so that rooms visited once don't build up
+            if not occupants:
+                del self._rooms[room]
+
+    def move(self, pid, fromroom, toroom):
+        """Moves player 'pid' from 'fromroom' to 'toroom'."""
+        self.remove(pid, fromroom)
+        self.add(pid, toroom)
+
+    def players_in(self, room):
+        """Returns the ids of the players in 'room'. The result must not be
+        changed, and changes as players come and go, so copy it before
+        moving players while looping over it.
+        """
+        return self._rooms.get(room, self._EMPTY)
+
+
+def save_snapshot(rooms, path):
+    """Writes the rooms returned by load_world to a snapshot file at
+    'path'. The file is replaced in one step, so a server starting at
+    the same time never sees half of it.
+    """
+    data = pickle.dumps(rooms, pickle.HIGHEST_PROTOCOL)
+    header = pickle.dumps((SNAPSHOT_VERSION, hashlib.sha256(data).hexdigest()), pickle.HIGHEST_PROTOCOL)
+
+    tmppath = path + ".tmp"
+    with open(tmppath, 'wb') as openfile:
+        openfile.write(SNAPSHOT_MAGIC)
+        openfile.write(len(header).to_bytes(4, 'big'))
+        openfile.write(header)
+        openfile.write(data)
+    os.replace(tmppath, path)
+
+
+def load_snapshot(path):
+    """Reads the rooms from the snapshot file at 'path'. Returns None,
+    after printing why, if the file is missing, was written for a
+    different version of the world layout or doesn't match its content
+    hash, in which case the world should be loaded from the database.
+    """
+    start = time.perf_counter()
+
+    try:
+        with open(path, 'rb') as openfile:
+            contents = openfile.read()
+    except OSError as e:
+        print("Not using world snapshot: {}".format(e))
+        return None
+
+    if not contents.startswith(SNAPSHOT_MAGIC):
+        print("Not using world snapshot: {} is not a snapshot file".format(path))
+        return None
+
+    offset = len(SNAPSHOT_MAGIC) + 4
+    headerlen = int.from_bytes(contents[len(SNAPSHOT_MAGIC):offset], 'big')
+    try:
+        version, digest = pickle.loads(contents[offset:offset + headerlen])
+    except (pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        print("Not using world snapshot: its header is damaged")
+        return None
+    data = contents[offset + headerlen:]
+
+    if version != SNAPSHOT_VERSION:
+        print("Not using world snapshot: it is version {}, expected {}".format(version, SNAPSHOT_VERSION))
+        return None
+    if hashlib.sha256(data).hexdigest() != digest:
+        print("Not using world snapshot: its contents don't match its hash")
+        return None
+
+    # unpickling creates a great many small objects at once, and the garbage
+    # collector would otherwise keep stopping to look through them all
+    gc.disable()
+    try:
+        rooms = pickle.loads(data)
+    finally:
+        gc.enable()
+    print("Loaded {} rooms from world snapshot in {:.1f} ms".format(len(rooms), (time.perf_counter() - start) * 1000))
+    return rooms
+
+
+def main():
+    from config import Config
+    from storage import open_storage
+
+    config = Config(sys.argv[1] if len(sys.argv) > 1 else 'db.json')
+    path = sys.argv[2] if len(sys.argv) > 2 else config['world_snapshot'] or 'world.snapshot'
+
+    db = open_storage(config)
+    try:
+        rooms = load_world(db)
+    finally:
+        db.close()
+
+    save_snapshot(rooms, path)
+    print("Wrote world snapshot to {}".format(path))
+
+
+if __name__ == "__main__":
+    main()